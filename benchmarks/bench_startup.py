@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Benchmark of the start-up time of main.py, with a budget for pickout.
+#
+# Each command runs `--runs` times in fresh processes against a small
+# database in a temporary directory, and the median wall time is reported
+# along with the start-up time of a bare interpreter. The modules imported
+# by main.py pickout and their import times (python -X importtime) are also
+# reported.
+#
+# The benchmark fails (exit status 1) if pickout takes more than `--budget`
+# seconds longer than the bare interpreter, or if it imports a module of the
+# update (heavy_modules), so that it can be run as a check.
+#
+# usage: ./benchmarks/bench_startup.py [--runs N] [--budget S] [--json FILE]
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.join(benchmarks_dir, "..")
+sys.path.insert(0, package_dir)
+main_py = os.path.join(package_dir, "main.py")
+
+# modules which pickout must not import
+heavy_modules = ["update", "urllib3", "lxml", "certifi", "http_session",
+                 "concurrent.futures", "xml.etree.ElementTree"]
+
+# name : arguments of the interpreter
+commands = {
+        "python" : ["-c", "pass"],
+        "main.py -h" : [main_py, "-h"],
+        "pickout" : [main_py, "pickout", "1ABC_A", "2DEF_B"],
+        "pickout --snapshot" : [main_py, "pickout",
+            "--snapshot", "protein_info.snapshot", "1ABC_A"],
+        }
+
+
+def make_database():
+    # Small protein_csv and its snapshot in the current directory
+    import constants
+    import snapshot
+    with sqlite3.connect(constants.sqlite3_dbpath) as conn:
+        conn.execute(
+                "CREATE TABLE protein_csv (pdb_id TEXT, chain_id TEXT, "
+                "uniprot_ac TEXT, protein_names TEXT, gene_names TEXT, "
+                "organism TEXT, kegg_id TEXT, mito_id TEXT, gene_id INTEGER, "
+                "resolution REAL, length INTEGER)")
+        conn.executemany(
+                "INSERT INTO protein_csv VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [("%dABC" % i, "A", "P%05d" % i, "Protein %d" % i, "G%d" % i,
+                    "Homo sapiens (Human)", "hsa:%d" % i, "MITO%d" % i, i,
+                    2.0, 100) for i in range(1000)])
+        conn.execute("CREATE INDEX protein_csv_pdb_id_chain_id "
+                     "ON protein_csv (pdb_id, chain_id)")
+        snapshot.write_snapshot(
+                conn.cursor(), constants.snapshot_path, 1)
+
+def wall_times(args, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+def imported_modules(args):
+    # Modules imported by main.py with args (besides those imported by the
+    # interpreter at start-up)
+    code = (
+            "import json, os, runpy, sys\n"
+            "before = set(sys.modules)\n"
+            "sys.argv = %r\n"
+            "sys.path.insert(0, os.path.dirname(sys.argv[0]))\n"
+            "try:\n"
+            "    runpy.run_path(sys.argv[0], run_name='__main__')\n"
+            "finally:\n"
+            "    sys.stderr.write(json.dumps("
+            "sorted(set(sys.modules) - before)))\n" % args)
+    out = subprocess.run([sys.executable, "-c", code], check=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                         text=True).stderr
+    return json.loads(out.strip().split("\n")[-1])
+
+def import_times(args):
+    # {top-level module imported by main.py: cumulative import seconds}
+    err = subprocess.run([sys.executable, "-X", "importtime"] + args,
+                         check=True, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, text=True).stderr
+    times = {}
+    for line in err.split("\n"):
+        # "import time: self [us] | cumulative | imported package"
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2]
+        if not name.startswith(" ") or name.startswith("  "):
+            continue # not imported at the top level
+        times[name.strip()] = int(fields[1]) / 1e6
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="benchmark of the start-up time of main.py")
+    parser.add_argument("--runs", type=int, default=20,
+            help="number of runs of each command (default: %(default)s)")
+    parser.add_argument("--budget", type=float, default=0.05,
+            help="seconds pickout may take longer than a bare interpreter "
+            "(default: %(default)s)")
+    parser.add_argument("--json", metavar="FILE",
+            help="also write the results to FILE in JSON")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        try:
+            make_database()
+            medians = {}
+            print("%-20s %12s %12s" % ("command", "median (s)", "min (s)"))
+            for name, command in commands.items():
+                times = wall_times(command, args.runs)
+                medians[name] = statistics.median(times)
+                print("%-20s %12.3f %12.3f" % (
+                    name, medians[name], min(times)))
+            modules = imported_modules(commands["pickout"])
+            imports = import_times(commands["pickout"])
+        finally:
+            os.chdir(cwd)
+
+    print("imports of pickout (cumulative):")
+    for name, seconds in sorted(imports.items(), key=lambda t: -t[1])[:10]:
+        print("  %-24s %8.1f ms" % (name, seconds * 1000))
+
+    overhead = medians["pickout"] - medians["python"]
+    heavy = [m for m in modules
+            if any(m == h or m.startswith(h + ".") for h in heavy_modules)]
+    print("pickout start-up: %.3f s over the interpreter (budget %.3f s)"
+          % (overhead, args.budget))
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"medians" : medians, "imports" : imports,
+                       "modules" : modules, "overhead" : overhead,
+                       "budget" : args.budget}, f, indent=2)
+
+    failed = False
+    if heavy:
+        print("FAILED: pickout imports %s" % ", ".join(heavy))
+        failed = True
+    if overhead > args.budget:
+        print("FAILED: pickout start-up is over budget")
+        failed = True
+    if failed:
+        quit(1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Benchmark of parsing UniProt's tab-separated responses.
+#
+# A synthetic mapping response is parsed in two ways, each in a fresh
+# process:
+#   * string : the whole body is decoded and split into lines (the former
+#              implementation of update.map_id)
+#   * stream : update.iter_tsv_rows reads the body line by line
+# and peak RSS, time to the first row and total time are reported.
+#
+# usage: ./benchmarks/bench_tsv.py [--rows N]
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def make_payload(path, rows):
+    # UniProt mapping response: "From\tTo" header and (UniProt AC, PDB ID)
+    with open(path, "w") as f:
+        f.write("From\tTo\n")
+        for i in range(rows):
+            f.write("P%07d\t%d%s\n" % (i, i % 10, "ABC"))
+
+def parse_string(f):
+    data = f.read().decode().strip()
+    info_line = data.split("\n")[1:]
+    return filter(
+            lambda t:
+            len(t) == 2,
+            map(lambda s: tuple(s.split("\t")), info_line)
+            )
+
+def parse_stream(f):
+    return update.iter_tsv_rows(f, 2)
+
+def run_child(method, path):
+    # Parse path with method and print "first_row_seconds total_seconds
+    # rows peak_rss_kb" (rows are consumed like executemany does).
+    global update
+    import update
+    start = time.perf_counter()
+    first = None
+    n = 0
+    with open(path, "rb") as f:
+        parse = parse_string if method == "string" else parse_stream
+        for row in parse(f):
+            if first is None:
+                first = time.perf_counter() - start
+            n += 1
+    total = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("%f %f %d %d" % (first or 0.0, total, n, rss))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="benchmark of parsing tab-separated responses")
+    parser.add_argument("--rows", type=int, default=1000000,
+            help="number of rows of the synthetic response")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(*args.child)
+        quit(0)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "mapping.tab")
+        make_payload(path, args.rows)
+        size = os.path.getsize(path)
+        print("payload: %d rows, %.1f MB" % (args.rows, size / 1024 ** 2))
+        print("%-8s %14s %10s %14s" % (
+            "method", "first row (s)", "total (s)", "peak RSS (MB)"))
+        for method in ("string", "stream"):
+            out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__),
+                        "--child", method, path],
+                    check=True, stdout=subprocess.PIPE, text=True
+                    ).stdout.split()
+            first, total, n, rss = float(out[0]), float(out[1]), int(out[2]), int(out[3])
+            print("%-8s %14.3f %10.3f %14.1f" % (method, first, total, rss / 1024))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Benchmark of update and pickout against local stand-in servers.
+#
+# For each data set size, mock_servers.py is started in its own process and
+# the following runs, each in a fresh process in a temporary directory:
+#   * update : update --snapshot with the URLs directed to the mock server
+#              (with --local, the mappings are loaded from dumps written by
+#              the mock server: update --source local:DIR)
+#   * pickout : pickout of sampled chains and pickout --all, from the
+#               database and from the snapshot (output to /dev/null)
+# End-to-end time and throughput, time of each stage, peak RSS and the number
+# of requests per path are reported.
+#
+# usage: ./benchmarks/bench_update.py [--proteins N [N ...]] [--latency S]
+#                                     [--key-latency S] [--sample N]
+#                                     [--local] [--json FILE]
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_dir, ".."))
+
+# pickout runs measured by run_pickout
+pickout_methods = ["chains", "chains-snapshot", "all", "all-snapshot"]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_update(port, source):
+    import constants
+    import mock_servers
+    mock_servers.point_constants(constants, port)
+    import update
+
+    start = time.perf_counter()
+    timings = update.update_sqlite3db(
+            use_cache=False, snapshot_path=constants.snapshot_path,
+            source=source)
+    seconds = time.perf_counter() - start
+    return {
+            "seconds" : seconds,
+            "stages" : {name: end - start
+                for name, (start, end) in timings.items()},
+            "peak_rss_mb" : peak_rss_mb(),
+            }
+
+def run_pickout(method, sample):
+    import constants
+    import export
+    import pickout
+
+    start = time.perf_counter()
+    if method.startswith("chains"):
+        with open("chains.txt") as f:
+            chains = list(pickout.read_chains(f))
+        if method == "chains":
+            rows = pickout.pickout_data(chains)
+        else:
+            rows = pickout.pickout_snapshot(chains, constants.snapshot_path)
+    elif method == "all":
+        rows = pickout.retrieve_all_data()
+    else:
+        rows = pickout.retrieve_all_snapshot(constants.snapshot_path)
+    n_rows = 0
+    def counted(rows):
+        nonlocal n_rows
+        for row in rows:
+            n_rows += 1
+            yield row
+    export.export(counted(rows), "csv", os.devnull)
+    return {
+            "seconds" : time.perf_counter() - start,
+            "rows" : n_rows,
+            "peak_rss_mb" : peak_rss_mb(),
+            }
+
+def child(mode, *args):
+    # Run mode in a fresh process (in the current directory) and return its
+    # result
+    out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode]
+            + [str(a) for a in args],
+            check=True, stdout=subprocess.PIPE, text=True
+            ).stdout
+    # The result is the last line
+    return json.loads(out.strip().split("\n")[-1])
+
+def write_sample(sample):
+    # Write up to sample random chains of the database to chains.txt
+    import sqlite3
+    with sqlite3.connect("protein_info.sqlite3") as conn:
+        chains = ["%s_%s" % row for row in conn.execute(
+            "SELECT DISTINCT pdb_id, chain_id FROM protein_csv")]
+    random.seed(0)
+    chains = random.sample(chains, min(sample, len(chains)))
+    with open("chains.txt", "w") as f:
+        f.write("\n".join(chains) + "\n")
+
+def bench(proteins, latency, key_latency, sample, local):
+    dumps = tempfile.TemporaryDirectory()
+    source = "local:" + dumps.name if local else "online"
+    server = subprocess.Popen(
+            [sys.executable, os.path.join(benchmarks_dir, "mock_servers.py"),
+                "--proteins", str(proteins),
+                "--latency", str(latency),
+                "--key-latency", str(key_latency)]
+            + (["--dumps", dumps.name] if local else []),
+            stdout=subprocess.PIPE, text=True
+            )
+    try:
+        port = int(server.stdout.readline())
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as d:
+            os.chdir(d)
+            try:
+                result = {"proteins" : proteins, "source" : source}
+                result["update"] = child("update", port, source)
+                with urllib.request.urlopen(
+                        "http://127.0.0.1:%d/stats" % port) as r:
+                    result["requests"] = json.loads(r.read())
+                write_sample(sample)
+                result["pickout"] = {method: child("pickout", method, sample)
+                        for method in pickout_methods}
+                result["database_mb"] = \
+                        os.path.getsize("protein_info.sqlite3") / 1024 ** 2
+                result["snapshot_mb"] = \
+                        os.path.getsize("protein_info.snapshot") / 1024 ** 2
+            finally:
+                os.chdir(cwd)
+    finally:
+        server.terminate()
+        server.wait()
+        dumps.cleanup()
+    return result
+
+def report(result):
+    u = result["update"]
+    print("== %d proteins (%s)" % (result["proteins"], result["source"]))
+    print("update : %.2f s (%.0f proteins/s), peak RSS %.1f MB, "
+          "database %.1f MB, snapshot %.1f MB" % (
+              u["seconds"], result["proteins"] / u["seconds"],
+              u["peak_rss_mb"], result["database_mb"], result["snapshot_mb"]))
+    for name, seconds in u["stages"].items():
+        print("  %-14s %8.2f s" % (name, seconds))
+    print("requests : %d" % sum(result["requests"].values()))
+    for path, n in sorted(result["requests"].items()):
+        print("  %-24s %6d" % (path, n))
+    print("%-16s %10s %10s %12s %14s" % (
+        "pickout", "rows", "time (s)", "rows/s", "peak RSS (MB)"))
+    for method, p in result["pickout"].items():
+        print("%-16s %10d %10.3f %12.0f %14.1f" % (
+            method, p["rows"], p["seconds"],
+            p["rows"] / p["seconds"] if p["seconds"] else 0,
+            p["peak_rss_mb"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="benchmark of update and pickout with local "
+            "stand-in servers")
+    parser.add_argument("--proteins", type=int, nargs="+", default=[1000],
+            help="numbers of proteins of the data sets (e.g. 1000 1000000)")
+    parser.add_argument("--latency", type=float, default=0.0,
+            help="seconds to delay every response")
+    parser.add_argument("--key-latency", type=float, default=0.0,
+            help="seconds to delay a response per ID in the request")
+    parser.add_argument("--sample", type=int, default=10000,
+            help="number of chains picked out (default: %(default)s)")
+    parser.add_argument("--local", action="store_true",
+            help="load the mappings from local dumps instead of the server")
+    parser.add_argument("--json", metavar="FILE",
+            help="also write the results to FILE in JSON")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        mode = args.child[0]
+        if mode == "update":
+            result = run_update(int(args.child[1]), args.child[2])
+        else:
+            result = run_pickout(args.child[1], int(args.child[2]))
+        print(json.dumps(result))
+        quit(0)
+
+    results = []
+    for proteins in args.proteins:
+        result = bench(proteins, args.latency, args.key_latency, args.sample,
+                       args.local)
+        report(result)
+        results.append(result)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Local stand-ins for MitoProteome, UniProt and RCSB.
+#
+# One HTTP server answers all the requests of the update with synthetic
+# responses shaped like those of the public services:
+#   * POST MITO_table.php : HTML table of Mito IDs and Gene IDs, in pages of
+#                           `nums` rows selected by `page`
+#   * GET /uniprot/ : tab-separated protein names, gene names and organism
+#   * GET /mapping/ : tab-separated ID mapping (Gene ID -> UniProt AC,
+#                     UniProt AC -> PDB ID / KEGG ID)
+#   * GET /pdb/rest/getEntityInfo : XML of entities and chains
+#   * GET /pdb/rest/describeMol : XML of chain lengths and accessions
+#   * GET /stats : JSON of the number of requests per path
+#
+# The same data can be written as the flat-file dumps read by
+# `update --source local:DIR` (see write_dumps): idmapping.dat.gz and
+# pdb_chain_uniprot.tsv.gz, which also have as many genes again that are not
+# in the MitoProteome table.
+#
+# The data set has `proteins` genes. Each gene maps to one UniProt AC. Two of
+# three UniProt ACs have structures (one to three PDB entries with one to
+# three protein chains; some entries also have a DNA entity, and NMR entries
+# have no resolution). Every response is delayed by `latency` seconds plus
+# `key_latency` seconds per ID in the request.
+#
+# usage: ./benchmarks/mock_servers.py [--proteins N] [--latency S] [--port P]
+#                                     [--dumps DIR]
+
+import argparse
+import email
+import gzip
+import http.server
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+
+def parse_form(content_type, body):
+    # Fields of a POST request body (multipart or URL-encoded)
+    if content_type.startswith("multipart/form-data"):
+        message = email.message_from_string(
+                "Content-Type: %s\r\n\r\n%s" % (content_type, body))
+        return {part.get_param("name", header="content-disposition"):
+                part.get_payload() for part in message.get_payload()}
+    return dict(urllib.parse.parse_qsl(body))
+
+def gene_id(i):
+    return str(1000 + i)
+
+def uniprot_ac(i):
+    return ("P%05d" % i) if i < 100000 else ("A0A%07d" % i)
+
+def protein_index(acc):
+    return int(acc[1:]) if acc.startswith("P") else int(acc[3:])
+
+def pdb_ids(i):
+    # PDB IDs of protein i (none for one of three proteins)
+    if i % 3 == 2:
+        return []
+    return ["%04X" % (0x1000 + 4 * i + k) for k in range(1 + i % 3)]
+
+def pdb_entry(pdb_id):
+    # (protein index, entry index) of pdb_id
+    j = int(pdb_id, 16) - 0x1000
+    return j // 4, j
+
+def protein_chains(pdb_id):
+    _, j = pdb_entry(pdb_id)
+    return "ABC"[:1 + j % 3]
+
+
+class DataSet:
+    def __init__(self, proteins):
+        self.proteins = proteins
+
+    def mito_table(self, nums, page):
+        # Yield the HTML page of rows (page - 1) * nums ... page * nums - 1
+        # in pieces
+        yield "<html><head><title>MitoProteome</title></head><body>\n"
+        yield "<table><tr><th>Mito ID</th><th>Gene ID</th>" \
+                "<th>Description</th></tr>\n"
+        for i in range((page - 1) * nums, min(page * nums, self.proteins)):
+            yield ('<tr><td><a href="MITO_detail.php?id=MITO%d">MITO%d</a>'
+                   '</td><td><a href="http://www.ncbi.nlm.nih.gov/sites/'
+                   'entrez?db=gene&cmd=Retrieve&dopt=full_report&'
+                   'list_uids=%s">%s</a></td><td>mitochondrial protein %d'
+                   '</td></tr>\n' % (i, i, gene_id(i), gene_id(i), i))
+        yield "</table></body></html>\n"
+
+    def idmapping(self):
+        # Yield the lines of idmapping.dat (genes 0 ... 2 * proteins - 1;
+        # one of ten UniProt ACs also has an isoform)
+        for i in range(2 * self.proteins):
+            acc = uniprot_ac(i)
+            yield "%s\tUniProtKB-ID\tPROT%d_HUMAN\n" % (acc, i)
+            yield "%s\tGeneID\t%s\n" % (acc, gene_id(i))
+            for pdb_id in pdb_ids(i):
+                yield "%s\tPDB\t%s\n" % (acc, pdb_id)
+            yield "%s\tKEGG\thsa:%s\n" % (acc, gene_id(i))
+            if i % 10 == 0:
+                yield "%s-2\tGeneID\t%s\n" % (acc, gene_id(i))
+
+    def sifts(self):
+        # Yield the lines of pdb_chain_uniprot.tsv (each protein chain is
+        # mapped in two segments which cover all of its residues)
+        yield "# 2026/10/18 - 12:00 | PDB: 42.26 | UniProt: 2026.04\n"
+        yield ("PDB\tCHAIN\tSP_PRIMARY\tRES_BEG\tRES_END\tPDB_BEG\t"
+               "PDB_END\tSP_BEG\tSP_END\n")
+        for i in range(2 * self.proteins):
+            for pdb_id in pdb_ids(i):
+                _, j = pdb_entry(pdb_id)
+                length = 50 + j * 37 % 900
+                for chain_id in protein_chains(pdb_id):
+                    for begin, end in [(1, length // 2),
+                                       (length // 2 + 1, length)]:
+                        yield "%s\t%s\t%s\t%d\t%d\t%d\t%d\t%d\t%d\n" % (
+                                pdb_id.lower(), chain_id, uniprot_ac(i),
+                                begin, end, begin, end, begin, end)
+
+    def write_dumps(self, directory):
+        # Write idmapping.dat.gz and pdb_chain_uniprot.tsv.gz to directory
+        for name, lines in [("idmapping.dat.gz", self.idmapping()),
+                            ("pdb_chain_uniprot.tsv.gz", self.sifts())]:
+            with gzip.open(os.path.join(directory, name), "wt",
+                           encoding="utf-8") as f:
+                f.writelines(lines)
+
+    def uniprot(self, accs):
+        yield "Entry\tProtein names\tGene names\tOrganism\n"
+        for acc in accs:
+            i = protein_index(acc)
+            yield ("%s\tProtein %d, mitochondrial (EC 1.1.1.%d) "
+                   "(Alternative name %d)\tGENE%d G%dL\t"
+                   "Homo sapiens (Human)\n" % (acc, i, i % 100, i, i, i))
+
+    def mapping(self, from_abbrev, to_abbrev, ids):
+        yield "From\tTo\n"
+        for x in ids:
+            if from_abbrev == "P_ENTREZGENEID":
+                yield "%s\t%s\n" % (x, uniprot_ac(int(x) - 1000))
+            elif to_abbrev == "PDB_ID":
+                for pdb_id in pdb_ids(protein_index(x)):
+                    yield "%s\t%s\n" % (x, pdb_id)
+            elif to_abbrev == "KEGG_ID":
+                yield "%s\thsa:%s\n" % (x, gene_id(protein_index(x)))
+
+    def entity_info(self, ids):
+        yield '<?xml version="1.0" standalone="no"?>\n<entityInfo>\n'
+        for pdb_id in ids:
+            _, j = pdb_entry(pdb_id)
+            if j % 7 == 0:
+                yield '<PDB structureId="%s" bioAssemblies="1">' \
+                        '<Method name="nmr" />' % pdb_id
+            else:
+                yield '<PDB structureId="%s" bioAssemblies="1" ' \
+                        'resolution="%.2f"><Method name="xray" />' % (
+                            pdb_id, 1.5 + (j % 20) / 10)
+            yield '<Entity id="1" type="protein">%s</Entity>' % "".join(
+                    '<Chain id="%s" />' % c for c in protein_chains(pdb_id))
+            if j % 5 == 0:
+                yield '<Entity id="2" type="dna"><Chain id="X" /></Entity>'
+            yield "</PDB>\n"
+        yield "</entityInfo>\n"
+
+    def describe_mol(self, chains):
+        yield '<?xml version="1.0" standalone="no"?>\n<molDescription>\n'
+        for t in chains:
+            pdb_id, chain_id = t.split(".")
+            i, j = pdb_entry(pdb_id)
+            yield ('<structureId id="%s" chainId="%s"><polymer entityNr="1" '
+                   'length="%d" type="protein"><macroMolecule name="Protein '
+                   '%d"><accession id="%s" /></macroMolecule></polymer>'
+                   '</structureId>\n' % (
+                       pdb_id, chain_id, 50 + j * 37 % 900, i, uniprot_ac(i)))
+        yield "</molDescription>\n"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def count(self, path):
+        with self.server.lock:
+            self.server.counts[path] = self.server.counts.get(path, 0) + 1
+
+    def send_chunks(self, chunks, n_keys, content_type="text/plain"):
+        # Send the response in chunked transfer encoding, so that the client
+        # can parse it while it is sent
+        time.sleep(self.server.latency + self.server.key_latency * n_keys)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        buf = []
+        size = 0
+        for chunk in chunks:
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= 65536:
+                self.write_chunk("".join(buf).encode("utf-8"))
+                buf = []
+                size = 0
+        self.write_chunk("".join(buf).encode("utf-8"))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def send_error_status(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        path = urllib.parse.urlparse(self.path).path
+        self.count(path)
+        if path.endswith("MITO_table.php"):
+            # urllib3 sends the fields of a POST request as multipart data
+            params = parse_form(self.headers.get("Content-Type", ""), body)
+            nums = int(params.get("nums", self.server.data.proteins))
+            page = int(params.get("page", 1))
+            self.send_chunks(self.server.data.mito_table(nums, page),
+                             nums, "text/html")
+        else:
+            self.send_error_status(404)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        data = self.server.data
+        if url.path == "/stats":
+            body = json.dumps(self.server.counts).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.count(url.path)
+        if url.path.endswith("/mapping/"):
+            ids = query["query"].split(",")
+            self.send_chunks(data.mapping(query["from"], query["to"], ids),
+                             len(ids))
+        elif url.path.endswith("/uniprot/"):
+            accs = [s.split(":")[1] for s in query["query"].split(" OR ")]
+            self.send_chunks(data.uniprot(accs), len(accs))
+        elif url.path.endswith("/getEntityInfo"):
+            ids = query["structureId"].split(",")
+            self.send_chunks(data.entity_info(ids), len(ids), "text/xml")
+        elif url.path.endswith("/describeMol"):
+            chains = query["structureId"].split(",")
+            self.send_chunks(data.describe_mol(chains), len(chains),
+                             "text/xml")
+        else:
+            self.send_error_status(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(proteins, latency=0.0, key_latency=0.0, port=0):
+    # Start the server in a thread and return it
+    # (its port is server.server_port)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.data = DataSet(proteins)
+    server.latency = latency
+    server.key_latency = key_latency
+    server.counts = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def point_constants(constants, port):
+    # Direct the URLs in constants to the server on localhost:port.
+    # This must be done before update is imported.
+    base = "http://127.0.0.1:%d/" % port
+    constants.mito_table_url = base + "MITO_table.php"
+    constants.uniprot_url = base + "uniprot/"
+    constants.uniprot_mapping_url = base + "mapping/"
+    constants.pdb_rest_url = base + "pdb/rest/"
+    constants.max_query_lengths = {
+            constants.uniprot_url : 6000,
+            constants.uniprot_mapping_url : 6000,
+            constants.pdb_rest_url : 6000,
+            }
+    constants.host_limits["127.0.0.1"] = {
+            "rate" : 1000.0, "burst" : 100, "concurrency" : 8}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="local stand-ins for MitoProteome, UniProt and RCSB")
+    parser.add_argument("--proteins", type=int, default=1000,
+            help="number of proteins of the data set")
+    parser.add_argument("--latency", type=float, default=0.0,
+            help="seconds to delay every response")
+    parser.add_argument("--key-latency", type=float, default=0.0,
+            help="seconds to delay a response per ID in the request")
+    parser.add_argument("--port", type=int, default=0,
+            help="port on localhost (any free port if 0)")
+    parser.add_argument("--dumps", metavar="DIR",
+            help="also write the dumps for update --source local:DIR")
+    args = parser.parse_args()
+    if args.dumps is not None:
+        DataSet(args.proteins).write_dumps(args.dumps)
+
+    server = start(args.proteins, args.latency, args.key_latency, args.port)
+    # The port is the first line of the output (read by bench_update.py)
+    print(server.server_port, flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Bulk loading of the tables of the update.
+#
+# The update writes into staging tables ("staging_" + table name) while
+# readers keep using the live tables. When all staging tables are loaded and
+# indexed, they replace the live tables in one transaction. The database is
+# in WAL mode, so readers are never blocked and see either the old or the new
+# tables as a whole.
+
+import sqlite3
+
+import constants
+
+
+def connect(path=None):
+    # Open the database path (constants.sqlite3_dbpath if None) with settings
+    # for bulk loading
+    conn = sqlite3.connect(
+            path or constants.sqlite3_dbpath,
+            timeout=constants.sqlite3_timeout
+            )
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = %s" % constants.sqlite3_synchronous)
+    cursor.execute("PRAGMA cache_size = -%d" % constants.sqlite3_cache_kb)
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+def staging_name(table_name):
+    return "staging_" + table_name
+
+def index_name(table_name, columns, version):
+    # Index names are global in a database, so indexes of staging tables are
+    # named after the live table and the version of the data. After the swap
+    # they do not collide with the indexes of the next update.
+    return "%s_%s_v%d" % (table_name, "_".join(columns), version)
+
+def create_index(cursor, table_name, columns, version):
+    # Index staging table of table_name on columns
+    cursor.execute(
+            "CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (
+                index_name(table_name, columns, version),
+                staging_name(table_name),
+                ", ".join(columns))
+            )
+
+def get_version(cursor):
+    # Version of the data in the live tables (0 if never updated)
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+def object_type(cursor, name):
+    # "table", "view", etc., or None if name does not exist
+    row = cursor.execute(
+            "SELECT type FROM sqlite_master WHERE name = ?", (name,)
+            ).fetchone()
+    return row[0] if row is not None else None
+
+def drop_staging_tables(cursor, table_names):
+    for table_name in table_names:
+        cursor.execute("DROP TABLE IF EXISTS %s" % staging_name(table_name))
+
+def begin_swap(conn, table_names, version):
+    # Replace live tables of table_names with their staging tables and set
+    # the version of the data. The transaction is left open so that the
+    # caller can add its own changes; commit it to publish the new tables.
+    conn.commit()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    for table_name in table_names:
+        live_type = object_type(cursor, table_name)
+        if live_type is not None:
+            cursor.execute("DROP %s %s" % (live_type.upper(), table_name))
+        cursor.execute("ALTER TABLE %s RENAME TO %s" % (
+            staging_name(table_name), table_name))
+    cursor.execute("PRAGMA user_version = %d" % version)
+    return cursor
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Thin client of the lookup daemon (main.py serve).
+#
+# This module imports no more than needed to talk to the daemon and write
+# the results, so that it starts quickly. See server.py for the protocol.
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+
+import constants
+import export
+import iterator_tools
+
+
+class ServerError(Exception):
+    pass
+
+
+class Client:
+    # Connection to the daemon, reused by all lookups
+    # port : port on localhost of an HTTP daemon, or None for a daemon on
+    #        the Unix socket socket_path (constants.serve_socket_path if None)
+    def __init__(self, socket_path=None, port=None):
+        if port is not None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", port)
+            self.sock = None
+        else:
+            self.conn = None
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path or constants.serve_socket_path)
+            self.rfile = self.sock.makefile("rb")
+
+    def request(self, request):
+        data = json.dumps(request).encode("utf-8")
+        if self.conn is not None:
+            self.conn.request("POST", "/lookup", body=data,
+                              headers={"Content-Type": "application/json"})
+            response = json.loads(self.conn.getresponse().read())
+        else:
+            self.sock.sendall(data + b"\n")
+            line = self.rfile.readline()
+            if not line:
+                raise ServerError("connection closed by the server")
+            response = json.loads(line)
+        if "error" in response:
+            raise ServerError(response["error"])
+        return response
+
+    def lookup(self, keys, by="chain"):
+        # Rows of protein_csv for keys (see server.lookup_keys for by).
+        # Keys are sent in chunks of constants.pickout_chunk_size.
+        for chunk in iterator_tools.split_iterator(
+                keys, constants.pickout_chunk_size):
+            for row in self.request(
+                    {"op": "lookup", "by": by, "keys": list(chunk)})["rows"]:
+                yield row
+
+    def status(self):
+        return self.request({"op": "status"})
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+        else:
+            self.rfile.close()
+            self.sock.close()
+
+
+def read_keys(f):
+    # Yield keys in file f (separated by whitespace)
+    for line in f:
+        for key in line.split():
+            yield key
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="look up proteins' information in a running "
+            "`main.py serve` daemon",
+            formatter_class=argparse.RawTextHelpFormatter
+            )
+    parser.add_argument(
+            "--socket",
+            help="Unix socket of the daemon (default: %(default)s)",
+            default=constants.serve_socket_path
+            )
+    parser.add_argument(
+            "--port",
+            help="port on localhost of an HTTP daemon",
+            type=int
+            )
+    parser.add_argument(
+            "--by",
+            help="kind of keys (default: %(default)s)",
+            # (server.lookup_keys, which is not imported to start quickly)
+            choices=["chain", "uniprot", "gene_id", "mito_id"],
+            default="chain"
+            )
+    parser.add_argument(
+            "-d", "--dest",
+            help="specify (non-existing) output filename",
+            nargs=1
+            )
+    parser.add_argument(
+            "--format",
+            help="output format (default: %(default)s)\n"
+            "parquet requires pyarrow",
+            choices=sorted(export.formats.keys()),
+            default="csv"
+            )
+    parser.add_argument(
+            "-f", "--from-file",
+            help="read keys (separated by whitespace) from file\n"
+            "(\"-\" for standard input)",
+            metavar="FILE"
+            )
+    parser.add_argument(
+            "keys",
+            help="keys (1A02_A, 10GS_A, etc. for chains)",
+            nargs="*"
+            )
+    args = parser.parse_args()
+
+    filename = None
+    if args.dest != None:
+        filename = args.dest[0]
+        if os.path.exists(filename):
+            sys.stderr.write("%s exists!\n"
+                             "exit\n" % filename)
+            quit(1)
+
+    from_file = None
+    keys = args.keys
+    if args.from_file == "-":
+        keys = iterator_tools.concat_iterator(keys, read_keys(sys.stdin))
+    elif args.from_file != None:
+        try:
+            from_file = open(args.from_file)
+        except OSError as e:
+            sys.stderr.write("%s\n"
+                             "exit\n" % e)
+            quit(1)
+        keys = iterator_tools.concat_iterator(keys, read_keys(from_file))
+
+    try:
+        client = Client(args.socket, args.port)
+        export.export(client.lookup(keys, args.by), args.format, filename)
+        client.close()
+    except (OSError, ServerError) as e:
+        sys.stderr.write("%s\n" % e)
+        quit(1)
+    finally:
+        if from_file != None:
+            from_file.close()
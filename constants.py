@@ -26,7 +26,100 @@ entrez_gene_record_url = "http://www.ncbi.nlm.nih.gov/sites/entrez"
 uniprot_url = "http://www.uniprot.org/uniprot/"
 uniprot_mapping_url = "http://www.uniprot.org/mapping/"
 mito_table_url = "http://www.mitoproteome.org/MITO_table.php"
+# The MitoProteome table is requested in pages of mito_table_page_size rows;
+# mito_table_page_param selects the page (starting from 1). The page size is
+# not smaller than the number of rows requested before paging, so that all of
+# them are taken even if the server ignores mito_table_page_param.
+mito_table_page_size = 10000
+mito_table_page_param = "page"
 pdb_rest_url = "https://www.rcsb.org/pdb/rest/"
 sqlite3_dbpath = "protein_info.sqlite3"
+snapshot_path = "protein_info.snapshot"
+# dumps read by `update --source local:DIR` (see local_source.py)
+local_idmapping_file = "idmapping.dat.gz"
+local_sifts_file = "pdb_chain_uniprot.tsv.gz"
 
 logfile = "csv.log"
+
+# Politeness settings for each host (see rate_limit.py).
+#   request rate : maximum number of requests per second
+#   burst        : number of requests that may be sent back to back
+#   concurrency  : maximum number of requests in flight at the same time
+host_limits = {
+        "www.mitoproteome.org" : {"rate" : 1.0, "burst" : 1, "concurrency" : 1},
+        "www.uniprot.org" : {"rate" : 3.0, "burst" : 3, "concurrency" : 3},
+        "www.rcsb.org" : {"rate" : 3.0, "burst" : 3, "concurrency" : 3},
+        }
+default_host_limit = {"rate" : 1.0, "burst" : 1, "concurrency" : 1}
+
+# number of batches of a stage fetched concurrently (see update.StageRun)
+fetch_workers = 4
+
+# HTTP connection pool settings (see http_session.py)
+http_num_pools = 10 # number of hosts whose connections are kept
+http_pool_maxsize = 4 # number of connections kept per host
+http_connect_timeout = 10.0 # seconds
+http_read_timeout = 120.0 # seconds
+
+# On-disk HTTP response cache (see http_cache.py)
+http_cache_path = "http_cache.sqlite3"
+http_cache_max_bytes = 2 * 1024 ** 3 # disk budget of the cache
+# seconds for which a cached response is used without asking the server
+# (the longest matching URL prefix is used)
+http_cache_ttls = {
+        mito_table_url : 7 * 24 * 3600,
+        uniprot_url : 24 * 3600,
+        uniprot_mapping_url : 24 * 3600,
+        pdb_rest_url : 7 * 24 * 3600,
+        }
+http_cache_default_ttl = 24 * 3600
+
+# `update --incremental` refetches keys fetched longer ago than this (seconds)
+incremental_max_age = 30 * 24 * 3600
+
+# number of input keys stored (and recorded in the journal) at a time
+# in each stage of the update
+journal_batch_size = 1000
+# a failed batch is retried batch_retries times, waiting
+# batch_retry_backoff * 2 ** (number of failures - 1) seconds in between
+batch_retries = 3
+batch_retry_backoff = 2.0
+
+# number of chains inserted at a time into the temporary table of pickout
+pickout_chunk_size = 10000
+
+# pickout output (see export.py)
+export_chunk_size = 10000 # rows formatted (or written as a row group) at a time
+export_buffer_size = 1024 ** 2 # bytes
+
+# Sizes of requests (see iterator_tools.AdaptiveBatcher)
+#   A request takes as many keys as fit in the encoded query length of its URL
+#   (max_query_lengths), up to request_batch_size keys, which is large enough
+#   for the query length to be the limit on every endpoint. Requests failing
+#   with one of bisect_statuses or timing out are split into halves, and later
+#   requests of the stage take at most half as many keys. Other errors (e.g.
+#   503 during an outage) do not say that the request was too large; its
+#   batch is retried after a backoff (see batch_retries).
+request_batch_size = 1000
+bisect_statuses = {413, 414}
+# limit of the encoded length of keys in a query string
+# (the longest matching URL prefix is used)
+max_query_lengths = {
+        uniprot_url : 6000,
+        uniprot_mapping_url : 6000,
+        pdb_rest_url : 6000,
+        }
+default_max_query_length = 2000
+
+# seconds to wait for a lock of the database held by another stage
+sqlite3_timeout = 60.0
+
+# settings of connections of the update (see bulk_load.py)
+sqlite3_synchronous = "NORMAL"
+sqlite3_cache_kb = 65536
+
+# serve: Unix socket (default) and port on localhost of the lookup daemon,
+# and interval in seconds between checks for a new version of the database
+serve_socket_path = "mp-manager.sock"
+serve_http_port = 8765
+serve_poll_interval = 2.0
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import csv
+import io
+import json
+import sys
+
+import constants
+import iterator_tools
+
+
+# names and Apache Arrow types of the columns of pickout's output
+columns = [
+        ("pdbid", "string"),
+        ("chain", "string"),
+        ("uniprot", "string"),
+        ("proteinnames", "string"),
+        ("genenames", "string"),
+        ("organism", "string"),
+        ("kegg", "string"),
+        ("mitoid", "string"),
+        ("entrezgeneid", "int64"),
+        ("resolution", "double"),
+        ("length", "int64"),
+        ]
+
+# columns which pickout --since writes before the columns above
+change_columns = [
+        ("change", "string"),
+        ("version", "int64"),
+        ]
+
+def column_names(fields=columns):
+    return [name for name, _ in fields]
+
+def write_csv(f, rows, fields=columns):
+    # Rows are formatted into a buffer by the csv module (which quotes
+    # fields containing commas) and written chunk by chunk.
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(column_names(fields))
+    for chunk in iterator_tools.split_iterator(rows, constants.export_chunk_size):
+        writer.writerows(chunk)
+        f.write(buf.getvalue())
+        buf.seek(0)
+        buf.truncate()
+    f.write(buf.getvalue())
+
+def write_jsonl(f, rows, fields=columns):
+    # One JSON object per line
+    names = column_names(fields)
+    for chunk in iterator_tools.split_iterator(rows, constants.export_chunk_size):
+        f.write("".join(
+            json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n"
+            for row in chunk))
+
+def write_parquet(f, rows, fields=columns):
+    # Rows are written as Parquet row groups of constants.export_chunk_size
+    # rows each. This format requires pyarrow.
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.stderr.write("pyarrow is required for parquet output\n")
+        quit(1)
+
+    schema = pa.schema([(name, pa.type_for_alias(t)) for name, t in fields])
+    with pq.ParquetWriter(f, schema) as writer:
+        for chunk in iterator_tools.split_iterator(
+                rows, constants.export_chunk_size):
+            chunk_columns = list(zip(*chunk))
+            writer.write_batch(pa.record_batch(
+                [pa.array(c, type=field.type)
+                    for c, field in zip(chunk_columns, schema)],
+                schema=schema
+                ))
+
+# format name : (writer, whether the writer writes bytes)
+formats = {
+        "csv" : (write_csv, False),
+        "jsonl" : (write_jsonl, False),
+        "parquet" : (write_parquet, True),
+        }
+
+def export(rows, format_name="csv", filename=None, fields=columns):
+    # Write rows in format_name to filename (standard output if None)
+    # fields : names and types of the columns of rows
+    writer, binary = formats[format_name]
+    if filename is None:
+        writer(sys.stdout.buffer if binary else sys.stdout, rows, fields)
+        sys.stdout.flush()
+        return
+
+    mode = "wb" if binary else "w"
+    encoding = None if binary else "utf-8"
+    newline = None if binary else ""
+    with open(filename, mode, buffering=constants.export_buffer_size,
+              encoding=encoding, newline=newline) as f:
+        writer(f, rows, fields)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+import constants
+
+
+# enabled : whether responses are looked up in / stored to the cache
+# offline : whether only cached responses are used (no network access)
+enabled = True
+offline = False
+
+_conn = None
+_lock = threading.Lock()
+_total_size = 0 # sum of the sizes of the cached bodies
+
+def configure(use_cache=True, offline_mode=False):
+    global enabled
+    global offline
+    enabled = use_cache or offline_mode
+    offline = offline_mode
+
+def _connection():
+    # Open the cache database on first use.
+    # Called with _lock held.
+    global _conn
+    global _total_size
+    if _conn is None:
+        _conn = sqlite3.connect(
+                constants.http_cache_path,
+                check_same_thread=False
+                )
+        _conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, "
+                "url TEXT, "
+                "body BLOB, " # zlib compressed response body
+                "etag TEXT, "
+                "last_modified TEXT, "
+                "fetched_at REAL, " # time of the last (re)validation
+                "accessed_at REAL, " # time of the last use (for LRU)
+                "size INTEGER)" # length of body
+                )
+        _conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                "ON responses (accessed_at)"
+                )
+        _conn.commit()
+        _total_size = _conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    return _conn
+
+def make_key(method, url, params):
+    # Key of a request: hash of method, URL and params (in sorted order)
+    s = json.dumps(
+            [method, url, sorted((params or {}).items())],
+            ensure_ascii=False
+            )
+    return hashlib.sha256(s.encode()).hexdigest()
+
+def get_ttl(url):
+    prefixes = [p for p in constants.http_cache_ttls if url.startswith(p)]
+    if not prefixes:
+        return constants.http_cache_default_ttl
+    return constants.http_cache_ttls[max(prefixes, key=len)]
+
+class Entry:
+    def __init__(self, key, body, etag, last_modified, fetched_at):
+        self.key = key
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, url):
+        return time.time() - self.fetched_at < get_ttl(url)
+
+    def validation_headers(self):
+        # Headers for a conditional request revalidating this entry
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+def lookup(key):
+    # Return the cached Entry of key, or None.
+    with _lock:
+        conn = _connection()
+        row = conn.execute(
+                "SELECT body, etag, last_modified, fetched_at "
+                "FROM responses WHERE key = ?",
+                (key,)
+                ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key)
+                )
+        conn.commit()
+    body, etag, last_modified, fetched_at = row
+    return Entry(key, zlib.decompress(body), etag, last_modified, fetched_at)
+
+def store_compressed(key, url, compressed, etag=None, last_modified=None):
+    # Cache body (compressed by zlib) and evict least recently used entries
+    # until the cache fits in constants.http_cache_max_bytes.
+    global _total_size
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        row = conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            _total_size -= row[0]
+        conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, compressed, etag, last_modified, now, now,
+                    len(compressed))
+                )
+        _total_size += len(compressed)
+        _evict(conn)
+        conn.commit()
+
+class Recorder:
+    # Compress a response body chunk by chunk while it is streamed
+    # (see http_session.ResponseReader) and store it when it ends.
+    def __init__(self, key, url, etag=None, last_modified=None):
+        self.key = key
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.compressor = zlib.compressobj()
+        self.chunks = []
+
+    def feed(self, data):
+        self.chunks.append(self.compressor.compress(data))
+
+    def finish(self):
+        self.chunks.append(self.compressor.flush())
+        store_compressed(
+                self.key, self.url, b"".join(self.chunks),
+                self.etag, self.last_modified)
+
+def touch(key):
+    # Mark the entry of key as revalidated now (after 304 Not Modified).
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        conn.execute(
+                "UPDATE responses SET fetched_at = ?, accessed_at = ? "
+                "WHERE key = ?",
+                (now, now, key)
+                )
+        conn.commit()
+
+def _evict(conn):
+    # Called with _lock held.
+    global _total_size
+    if _total_size <= constants.http_cache_max_bytes:
+        return
+    rows = conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at")
+    evicted = []
+    for key, size in rows:
+        if _total_size <= constants.http_cache_max_bytes:
+            break
+        evicted.append((key,))
+        _total_size -= size
+    rows.close()
+    conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import io
+import threading
+
+import certifi
+import urllib3
+
+import constants
+
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    # Return the process-wide urllib3.PoolManager.
+    # Connections to each host are kept alive and reused by later requests,
+    # and responses are requested gzip/deflate compressed (urllib3 decodes
+    # them transparently).
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = urllib3.PoolManager(
+                    num_pools = constants.http_num_pools,
+                    maxsize = constants.http_pool_maxsize,
+                    block = True, # wait for a free connection
+                    headers = urllib3.make_headers(
+                        keep_alive = True,
+                        accept_encoding = True,
+                        ),
+                    timeout = urllib3.Timeout(
+                        connect = constants.http_connect_timeout,
+                        read = constants.http_read_timeout,
+                        ),
+                    cert_reqs = "CERT_REQUIRED",
+                    ca_certs = certifi.where()
+                    )
+        return _session
+
+def close_session():
+    # Close all pooled connections.
+    # The next get_session() creates a new PoolManager.
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.clear()
+            _session = None
+
+
+class ResponseReader(io.RawIOBase):
+    # Binary file object reading the body of a urllib3 response requested
+    # with preload_content=False, as it is downloaded.
+    #
+    # recorder (optional) receives the body: recorder.feed(data) is called
+    # for each chunk and recorder.finish() at the end of the body.
+    # on_close (optional) is called with the number of bytes read when the
+    # reader is closed (also if the connection fails then).
+    # Closing the reader returns the connection to the pool.
+    def __init__(self, response, recorder=None, on_close=None):
+        self.response = response
+        self.recorder = recorder
+        self.on_close = on_close
+        self.n_bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.response.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.n_bytes += n
+        if self.recorder is not None:
+            if n > 0:
+                self.recorder.feed(data)
+            else:
+                self.recorder.finish()
+                self.recorder = None
+        return n
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.response.drain_conn()
+                self.response.release_conn()
+            finally:
+                if self.on_close is not None:
+                    self.on_close(self.n_bytes)
+        super().close()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Instrumentation of the update.
+#
+# Counters and histograms are recorded by name and label from any thread,
+# for instance count("http.bytes", "/uniprot/", 1234) or
+# observe("http.latency", "/uniprot/", 0.25). report() returns all of them
+# as a dictionary which can be dumped as JSON (see update --profile).
+#
+# Names starting with "sleep." are times spent waiting (rate limits, retry
+# backoff), and names ending with "_seconds" under "batch." and "sqlite." are
+# times spent working. Both are summed by report() in thread-seconds, which
+# can exceed the wall time because stages and batches run concurrently.
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class Histogram:
+    # Histogram with buckets of powers of two: a value v is counted in the
+    # bucket of the smallest 2 ** k that is >= v (0 for values <= 0).
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        bound = 2.0 ** math.ceil(math.log2(value)) if value > 0 else 0.0
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket which contains the q-quantile
+        rank = q * self.count
+        n = 0
+        for bound in sorted(self.buckets):
+            n += self.buckets[bound]
+            if n >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def report(self):
+        return {
+                "count" : self.count,
+                "sum" : self.total,
+                "min" : self.min,
+                "max" : self.max,
+                "mean" : self.total / self.count if self.count else None,
+                "p50" : self.quantile(0.5),
+                "p90" : self.quantile(0.9),
+                "p99" : self.quantile(0.99),
+                "buckets" : {"<=%g" % bound: self.buckets[bound]
+                    for bound in sorted(self.buckets)},
+                }
+
+
+def count(name, label="", n=1):
+    with _lock:
+        key = (name, label)
+        _counters[key] = _counters.get(key, 0) + n
+
+def observe(name, label, value):
+    with _lock:
+        key = (name, label)
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].add(value)
+
+@contextmanager
+def timer(name, label=""):
+    # Usage:
+    #   with instrument.timer("sqlite.store_seconds", stage_name):
+    #       (work to be timed)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, label, time.perf_counter() - start)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def is_work(name):
+    return name.startswith(("batch.", "sqlite.")) and name.endswith("_seconds")
+
+def report():
+    # {"counters": {name: {label: n}},
+    #  "histograms": {name: {label: {"count": ..., "p50": ..., ...}}},
+    #  "sleep_seconds": {name: total}, "work_seconds": {name: total}}
+    with _lock:
+        counters = {}
+        for (name, label), n in sorted(_counters.items()):
+            counters.setdefault(name, {})[label] = n
+        histograms = {}
+        sleep_seconds = {}
+        work_seconds = {}
+        for (name, label), h in sorted(_histograms.items()):
+            histograms.setdefault(name, {})[label] = h.report()
+            if name.startswith("sleep."):
+                sleep_seconds[name] = sleep_seconds.get(name, 0.0) + h.total
+            elif is_work(name):
+                work_seconds[name] = work_seconds.get(name, 0.0) + h.total
+    return {
+            "counters" : counters,
+            "histograms" : histograms,
+            "sleep_seconds" : sleep_seconds,
+            "work_seconds" : work_seconds,
+            }
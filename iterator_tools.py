@@ -27,6 +27,7 @@
 
 
 from itertools import groupby
+import threading
 
 def split_iterator(iterator, group_n):
     for i, item in groupby(enumerate(iterator), lambda x: x[0] // group_n):
@@ -36,3 +37,45 @@ def concat_iterator(*iters):
     for i in iters:
         for item in i:
             yield item
+
+
+class AdaptiveBatcher:
+    # Split keys into batches sent in one request each.
+    #
+    # A batch has at most `size` keys, and the sum of key_cost(key) of its
+    # keys (e.g. the length of the keys encoded in the URL) is at most
+    # max_cost. `size` shrinks only when a request fails because it is too
+    # large, so that, otherwise, the batches depend on the keys only and
+    # repeated runs send the same requests (see http_cache.py). Methods are
+    # thread-safe, so that one batcher can be shared by concurrent requests
+    # to an endpoint.
+    def __init__(self, size, max_cost, key_cost=len, min_size=1):
+        self.size = size
+        self.max_cost = max_cost
+        self.key_cost = key_cost
+        self.min_size = min_size
+        self.lock = threading.Lock()
+
+    def split(self, keys):
+        # Yield lists of keys. Each batch is sized when it is started, so
+        # that it reflects the latest failures.
+        batch = []
+        cost = 0
+        for key in keys:
+            key_cost = self.key_cost(key)
+            if batch and (len(batch) >= self.size
+                          or cost + key_cost > self.max_cost):
+                yield batch
+                batch = []
+                cost = 0
+            batch.append(key)
+            cost += key_cost
+        if batch:
+            yield batch
+
+    def record_failure(self, n_keys):
+        # A request of n_keys keys failed because it was too large (the
+        # server rejected its URL or timed out). Batches are at most half as
+        # large from now on.
+        with self.lock:
+            self.size = max(self.min_size, min(self.size, n_keys) // 2)
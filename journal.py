@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Journal of the batches of each stage of the update.
+#
+# Batches of a stage are recorded before they are fetched, and each batch is
+# marked as done in the same transaction that stores its rows. A stage is
+# marked as done when all of its batches are done and no more batches will
+# be added. Therefore an interrupted update can be resumed at the first batch
+# that is not done.
+
+import json
+
+
+def create_table(cursor):
+    # update_journal table:
+    #   stage : name of the stage
+    #   batch : index of the batch in the stage
+    #   keys : JSON list of the input keys of the batch (null: no input)
+    #   done : 1 if the rows of the batch are stored, otherwise 0
+    # update_journal_stages table:
+    #   stage : name of the stage
+    #   incremental : 1 if the stage runs in incremental mode, otherwise 0
+    #   done : 1 if the stage is finished, otherwise 0
+    #
+    # Journals of former versions (without the incremental column) cannot be
+    # resumed, so they are dropped.
+    columns = [row[1] for row in cursor.execute(
+        "PRAGMA table_info(update_journal_stages)").fetchall()]
+    if columns and "incremental" not in columns:
+        cursor.execute("DROP TABLE update_journal_stages")
+        cursor.execute("DROP TABLE IF EXISTS update_journal")
+    cursor.execute(
+            "CREATE TABLE IF NOT EXISTS update_journal ("
+            "stage TEXT, batch INTEGER, keys TEXT, done INTEGER, "
+            "PRIMARY KEY (stage, batch))"
+            )
+    cursor.execute(
+            "CREATE TABLE IF NOT EXISTS update_journal_stages ("
+            "stage TEXT PRIMARY KEY, incremental INTEGER, done INTEGER)"
+            )
+
+def clear(cursor, stage_name=None):
+    # Forget stage_name and its batches (all stages if None)
+    if stage_name is None:
+        cursor.execute("DELETE FROM update_journal")
+        cursor.execute("DELETE FROM update_journal_stages")
+    else:
+        cursor.execute(
+                "DELETE FROM update_journal WHERE stage = ?", (stage_name,))
+        cursor.execute(
+                "DELETE FROM update_journal_stages WHERE stage = ?",
+                (stage_name,))
+
+def start_stage(cursor, stage_name, incremental):
+    cursor.execute(
+            "INSERT OR REPLACE INTO update_journal_stages VALUES (?, ?, 0)",
+            (stage_name, int(incremental))
+            )
+
+def is_incremental(cursor, stage_name):
+    # Whether stage_name was started in incremental mode
+    row = cursor.execute(
+            "SELECT incremental FROM update_journal_stages WHERE stage = ?",
+            (stage_name,)
+            ).fetchone()
+    return row is not None and bool(row[0])
+
+def is_empty(cursor):
+    # Whether no stage is recorded (nothing to resume)
+    return cursor.execute(
+            "SELECT COUNT(*) FROM update_journal_stages").fetchone()[0] == 0
+
+def finish_stage(cursor, stage_name):
+    cursor.execute(
+            "UPDATE update_journal_stages SET done = 1 WHERE stage = ?",
+            (stage_name,)
+            )
+
+def stage_status(cursor, stage_name):
+    # Return None if stage_name is not started,
+    # "done" if it is finished, otherwise "partial".
+    row = cursor.execute(
+            "SELECT done FROM update_journal_stages WHERE stage = ?",
+            (stage_name,)
+            ).fetchone()
+    if row is None:
+        return None
+    return "done" if row[0] else "partial"
+
+def add_batch(cursor, stage_name, batch_index, batch):
+    # batch : list of keys (or None)
+    cursor.execute(
+            "INSERT INTO update_journal VALUES (?, ?, ?, 0)",
+            (stage_name, batch_index, json.dumps(batch))
+            )
+
+def batch_count(cursor, stage_name):
+    return cursor.execute(
+            "SELECT COUNT(*) FROM update_journal WHERE stage = ?",
+            (stage_name,)
+            ).fetchone()[0]
+
+def journaled_keys(cursor, stage_name):
+    # Yield the keys of all batches (done or not) of stage_name
+    query = "SELECT keys FROM update_journal WHERE stage = ?"
+    for (keys,) in cursor.execute(query, (stage_name,)).fetchall():
+        for key in json.loads(keys) or []:
+            yield key
+
+def pending_batches(cursor, stage_name):
+    # Return [(index, keys) ...] of the batches which are not done
+    rows = cursor.execute(
+            "SELECT batch, keys FROM update_journal "
+            "WHERE stage = ? AND done = 0 ORDER BY batch",
+            (stage_name,)
+            ).fetchall()
+    return [(i, json.loads(keys)) for i, keys in rows]
+
+def mark_done(cursor, stage_name, batch_index):
+    cursor.execute(
+            "UPDATE update_journal SET done = 1 WHERE stage = ? AND batch = ?",
+            (stage_name, batch_index)
+            )
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Mappings read from local copies of the UniProt and SIFTS flat-file dumps.
+#
+# With `update --source local:DIR`, the tables which the update would fill by
+# many requests to UniProt and RCSB are loaded from these files in DIR
+# (see update.LocalRun):
+#
+#   idmapping.dat.gz (UniProt, "UniProt AC <tab> ID type <tab> ID")
+#       -> gene_uniprot, uniprot_pdb, uniprot_kegg
+#   pdb_chain_uniprot.tsv.gz (SIFTS, "PDB <tab> CHAIN <tab> SP_PRIMARY <tab>
+#   RES_BEG <tab> RES_END <tab> ...")
+#       -> chain_info
+#
+# Each file is read once, line by line, and only the lines of the IDs which
+# the update needs (looked up in a set) are kept.
+
+import gzip
+import os
+from itertools import groupby
+
+import constants
+
+
+# ID types of idmapping.dat which are loaded
+idmapping_types = {"GeneID", "PDB", "KEGG"}
+
+def source_directory(source):
+    # "online" -> None, "local:DIR" -> DIR
+    # Raise ValueError for anything else.
+    if source == "online":
+        return None
+    if source.startswith("local:") and len(source) > len("local:"):
+        return source[len("local:"):]
+    raise ValueError("unknown source: %s (online or local:DIR)" % source)
+
+def dump_paths(directory):
+    # (path of idmapping.dat.gz, path of pdb_chain_uniprot.tsv.gz)
+    return (os.path.join(directory, constants.local_idmapping_file),
+            os.path.join(directory, constants.local_sifts_file))
+
+def missing_dumps(directory):
+    return [path for path in dump_paths(directory)
+            if not os.path.isfile(path)]
+
+def open_dump(path):
+    return gzip.open(path, "rt", encoding="utf-8", newline="\n")
+
+def iter_idmapping(path, gene_ids):
+    # Yield (table name, row) for each UniProt AC in idmapping.dat.gz (path)
+    # which maps to a Gene ID in gene_ids (set of str):
+    #   ("gene_uniprot", (Gene ID, UniProt AC))
+    #   ("uniprot_pdb", (UniProt AC, PDB ID))
+    #   ("uniprot_kegg", (UniProt AC, KEGG ID))
+    #
+    # The lines of a UniProt AC are contiguous in the file, so that its PDB
+    # and KEGG IDs are kept only if one of its Gene IDs is in gene_ids.
+    # Isoforms ("P31946-2") are skipped, as the online mapping gives
+    # canonical UniProt ACs only.
+    with open_dump(path) as f:
+        entries = (line.rstrip("\n").split("\t") for line in f)
+        entries = (t for t in entries
+                   if len(t) == 3 and t[1] in idmapping_types)
+        for acc, group in groupby(entries, lambda t: t[0]):
+            if "-" in acc:
+                continue
+            group = list(group)
+            genes = [t[2] for t in group
+                     if t[1] == "GeneID" and t[2] in gene_ids]
+            if not genes:
+                continue
+            for gene_id in genes:
+                yield ("gene_uniprot", (gene_id, acc))
+            for _, id_type, value in group:
+                if id_type == "PDB":
+                    # "1ABC" or "1ABC:A"
+                    yield ("uniprot_pdb", (acc, value.split(":")[0].upper()))
+                elif id_type == "KEGG":
+                    yield ("uniprot_kegg", (acc, value))
+
+def iter_sifts_chains(path, pdb_ids):
+    # Yield (PDB ID, chain ID, length, UniProt AC) for each chain in
+    # pdb_chain_uniprot.tsv.gz (path) of a PDB ID in pdb_ids (set of
+    # upper-case str).
+    #
+    # The file has no chain lengths; length is the last residue (in SEQRES
+    # numbering) mapped to UniProt, so residues after it are not counted.
+    # UniProt AC is that of the first segment of the chain.
+    chains = {}
+    with open_dump(path) as f:
+        for line in f:
+            if line.startswith(("#", "PDB\t")):
+                continue
+            t = line.rstrip("\n").split("\t")
+            if len(t) < 5:
+                continue
+            pdb_id = t[0].upper()
+            if pdb_id not in pdb_ids:
+                continue
+            try:
+                end = int(t[4])
+            except ValueError:
+                continue
+            chain = chains.setdefault((pdb_id, t[1]), [end, t[2]])
+            chain[0] = max(chain[0], end)
+    for (pdb_id, chain_id), (length, acc) in chains.items():
+        yield (pdb_id, chain_id, length, acc)
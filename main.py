@@ -27,72 +27,324 @@
 # SOFTWARE.
 
 import argparse
+import os
+import sys
 
-import update
-import pickout
+import constants
+import export # only for the names of the formats (no heavy imports)
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-            description="MP-manager is the mitochondrial protein's CSV file manager.",
-            formatter_class=argparse.RawTextHelpFormatter
+# Subcommands are registered in `commands`. The module of each subcommand is
+# imported only when the subcommand runs, so that, for instance, pickout does
+# not pay for importing update (urllib3, lxml, certifi, etc.).
+
+def add_update_arguments(parser_update):
+    parser_update.add_argument(
+            "--no-cache",
+            help="ignore the HTTP response cache",
+            action="store_true"
             )
-    subparsers = parser.add_subparsers(
-            dest="command",
+    parser_update.add_argument(
+            "--offline",
+            help="use cached HTTP responses only (no network access)",
+            action="store_true"
+            )
+    parser_update.add_argument(
+            "-i", "--incremental",
+            help="fetch only new data and data older than --max-age",
+            action="store_true"
+            )
+    parser_update.add_argument(
+            "--max-age",
+            help="age in days after which data are fetched again\n"
+            "with --incremental (default: %(default)s)",
+            type=float,
+            default=constants.incremental_max_age / (24 * 3600)
+            )
+    parser_update.add_argument(
+            "--resume",
+            help="continue an interrupted update",
+            action="store_true"
+            )
+    parser_update.add_argument(
+            "--snapshot",
+            help="also write a snapshot file for pickout --snapshot\n"
+            "(FILE: %s if omitted)" % constants.snapshot_path,
+            nargs="?",
+            const=constants.snapshot_path,
+            metavar="FILE"
             )
-    parser_update = subparsers.add_parser(
-            "update",
-            description="update sqlite3 database",
-            help="update sqlite3 database"
+    parser_update.add_argument(
+            "--profile",
+            help="write request, batch and sqlite statistics to FILE (JSON)",
+            metavar="FILE"
             )
-    parser_pickout = subparsers.add_parser(
-            "pickout",
-            description="pick out given proteins' information",
-            help="pick out given proteins' information"
+    parser_update.add_argument(
+            "--cprofile",
+            help="profile STAGE with cProfile (with --profile)\n"
+            "statistics are written to FILE without extension\n"
+            "+ .STAGE.prof (can be given several times)",
+            action="append",
+            default=[],
+            metavar="STAGE"
             )
+    parser_update.add_argument(
+            "--source",
+            help="online (default), or local:DIR to load the UniProt and\n"
+            "PDB chain mappings from %s and\n"
+            "%s in DIR" % (
+                constants.local_idmapping_file, constants.local_sifts_file),
+            default="online"
+            )
+
+def run_update(args, parser_update):
+    import local_source
+    import update
+    if args.cprofile and args.profile == None:
+        parser_update.error("--cprofile requires --profile")
+    try:
+        local_dir = local_source.source_directory(args.source)
+    except ValueError as e:
+        parser_update.error(str(e))
+    stage_names = [stage.name for stage in update.stages]
+    for name in args.cprofile:
+        if name not in stage_names:
+            parser_update.error("unknown stage %s (choose from %s)"
+                                % (name, ", ".join(stage_names)))
+        if local_dir is not None and name in update.local_stage_names:
+            parser_update.error("--cprofile %s cannot be used with --source "
+                                "local:DIR (it is loaded from the dumps)"
+                                % name)
+    update.setup_logging()
+    try:
+        update.update_sqlite3db(
+                use_cache=not args.no_cache,
+                offline=args.offline,
+                incremental=args.incremental,
+                max_age=args.max_age * 24 * 3600,
+                resume=args.resume,
+                snapshot_path=args.snapshot,
+                profile_path=args.profile,
+                cprofile_stages=args.cprofile,
+                source=args.source
+                )
+    except update.UpdateError as e:
+        sys.stderr.write("%s\n" % e)
+        quit(1)
+    print("Update finished.")
+
+def add_pickout_arguments(parser_pickout):
     parser_pickout.add_argument(
             "-d", "--dest",
             help="specify (non-existing) output filename",
             nargs=1
             )
+    parser_pickout.add_argument(
+            "--format",
+            help="output format (default: %(default)s)\n"
+            "parquet requires pyarrow",
+            choices=sorted(export.formats.keys()),
+            default="csv"
+            )
     parser_pickout.add_argument(
             "-a", "--all",
             help="show all proteins' data",
             action="store_true"
             )
+    parser_pickout.add_argument(
+            "-f", "--from-file",
+            help="read PDB chains (separated by whitespace) from file\n"
+            "(\"-\" for standard input)",
+            metavar="FILE"
+            )
+    parser_pickout.add_argument(
+            "--snapshot",
+            help="read a snapshot file written by update --snapshot\n"
+            "instead of the database (FILE: %s if omitted)"
+            % constants.snapshot_path,
+            nargs="?",
+            const=constants.snapshot_path,
+            metavar="FILE"
+            )
+    parser_pickout.add_argument(
+            "--since",
+            help="show the rows added, changed or removed after\n"
+            "VERSION of the data (0 for all rows), preceded by\n"
+            "the change and the version in which it was made\n"
+            "(every update counts the version up)",
+            type=int,
+            metavar="VERSION"
+            )
+    filters = parser_pickout.add_argument_group(
+            "filters",
+            "pick out proteins which match all of the given filters\n"
+            "(among the given chains, if any); ID filters can be\n"
+            "given several times to match any of the IDs")
+    filters.add_argument(
+            "--uniprot",
+            help="UniProt AC",
+            action="append",
+            metavar="AC"
+            )
+    filters.add_argument(
+            "--gene-id",
+            help="Gene ID",
+            action="append",
+            type=int,
+            metavar="ID"
+            )
+    filters.add_argument(
+            "--mito-id",
+            help="Mito ID",
+            action="append",
+            metavar="ID"
+            )
+    filters.add_argument(
+            "--kegg",
+            help="KEGG ID (hsa:1234, etc.)",
+            action="append",
+            metavar="ID"
+            )
+    filters.add_argument(
+            "--organism",
+            help="organism (prefix of the name, e.g. \"Homo sapiens\")",
+            action="append",
+            metavar="NAME"
+            )
+    filters.add_argument(
+            "--max-resolution",
+            help="maximum resolution in angstroms\n"
+            "(structures without resolution do not match)",
+            type=float,
+            metavar="R"
+            )
+    filters.add_argument(
+            "--min-length",
+            help="minimum length of chain",
+            type=int,
+            metavar="N"
+            )
     parser_pickout.add_argument(
             "chains",
             help="PDB chain (1A02_A, 10GS_A, etc.) list",
             nargs="*"
             )
-    args = parser.parse_args()
 
-    if args.command == "update":
-        update.update_sqlite3db()
-    elif args.command == "pickout":
-        column_names = (
-                "pdbid,chain,uniprot,proteinnames,genenames,"
-                "organism,kegg,mitoid,entrezgeneid"
-                )
-        if args.all:
-            tuples = pickout.retrieve_all_data()
-        else:
-            tuples = pickout.pickout_data(args.chains)
+def run_pickout(args, parser_pickout):
+    import iterator_tools
+    import pickout
+    filename = None
+    if args.dest != None:
+        filename = args.dest[0]
+        if os.path.exists(filename):
+            sys.stderr.write("%s exists!\n"
+                             "exit\n" % filename)
+            quit(1)
+
+    filters = {name: getattr(args, name) for name in pickout.filter_columns}
+    has_filters = any(v is not None for v in filters.values())
+    if has_filters and args.snapshot != None:
+        parser_pickout.error("filters cannot be used with --snapshot")
+    if args.since != None:
+        if (args.all or has_filters or args.chains or
+                args.from_file != None or args.snapshot != None):
+            parser_pickout.error("--since cannot be used with other selections")
+        export.export(pickout.pickout_since(args.since), args.format, filename,
+                      export.change_columns + export.columns)
+        return
 
-        if args.dest == None:
-            print(column_names)
-            for t in tuples:
-                print("%s,%s,%s,%s,%s,%s,%s,%s,%s" % t)
+    from_file = None
+    if args.from_file != None and args.from_file != "-":
+        try:
+            from_file = open(args.from_file)
+        except OSError as e:
+            sys.stderr.write("%s\n"
+                             "exit\n" % e)
+            quit(1)
+
+    if args.all and args.snapshot != None:
+        tuples = pickout.retrieve_all_snapshot(args.snapshot)
+    elif args.all and not has_filters:
+        tuples = pickout.retrieve_all_data()
+    elif has_filters and not args.chains and args.from_file == None:
+        tuples = pickout.pickout_filtered(filters)
+    else:
+        chains = args.chains
+        if args.from_file == "-":
+            chains = iterator_tools.concat_iterator(
+                    chains, pickout.read_chains(sys.stdin))
+        elif from_file != None:
+            chains = iterator_tools.concat_iterator(
+                    chains, pickout.read_chains(from_file))
+        if args.snapshot != None:
+            tuples = pickout.pickout_snapshot(chains, args.snapshot)
         else:
-            filename = args.dest[0]
-            if os.path.exists(filename):
-                sys.stderr.write("%s exists!\n"
-                                 "exit\n" % filename)
-                quit(1)
-
-            with open(filename, "w") as f:
-                f.write("%s\n" % column_names)
-                for t in tuples:
-                    f.write("%s,%s,%s,%s,%s,%s,%s,%s,%s\n" % t)
+            tuples = pickout.pickout_data(chains, filters)
+
+    try:
+        export.export(tuples, args.format, filename)
+    finally:
+        if from_file != None:
+            from_file.close()
+
+def add_serve_arguments(parser_serve):
+    parser_serve.add_argument(
+            "--socket",
+            help="Unix socket to listen on (default: %(default)s)",
+            default=constants.serve_socket_path
+            )
+    parser_serve.add_argument(
+            "--http",
+            help="listen on localhost:PORT over HTTP instead of the socket\n"
+            "(PORT: %d if omitted)" % constants.serve_http_port,
+            nargs="?",
+            type=int,
+            const=constants.serve_http_port,
+            metavar="PORT"
+            )
+
+def run_serve(args, parser_serve):
+    import server
+    server.serve(socket_path=args.socket, port=args.http)
+
+# name, description, function adding the arguments, function running the
+# subcommand (called with the parsed arguments and the subparser)
+commands = [
+        ("update",
+            "update sqlite3 database",
+            add_update_arguments, run_update),
+        ("pickout",
+            "pick out given proteins' information",
+            add_pickout_arguments, run_pickout),
+        ("serve",
+            "serve lookups from memory until interrupted\n"
+            "(use client.py to look up)",
+            add_serve_arguments, run_serve),
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="MP-manager is the mitochondrial protein's CSV file manager.",
+            formatter_class=argparse.RawTextHelpFormatter
+            )
+    subparsers = parser.add_subparsers(
+            dest="command",
+            )
+    subcommand_parsers = {}
+    for name, description, add_arguments, run in commands:
+        subparser = subparsers.add_parser(
+                name,
+                description=description,
+                help=description.split("\n")[0],
+                formatter_class=argparse.RawTextHelpFormatter
+                )
+        add_arguments(subparser)
+        subcommand_parsers[name] = (subparser, run)
+    args = parser.parse_args()
+
+    if args.command in subcommand_parsers:
+        subparser, run = subcommand_parsers[args.command]
+        run(args, subparser)
     else:
         parser.print_help()
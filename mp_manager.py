@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Python API of MP-manager.
+#
+#   manager = mp_manager.MPManager()
+#   for protein in manager.lookup_chains(["2VGZ_A", "3FCK_A"]):
+#       print(protein.uniprot_ac, protein.resolution)
+#
+# An MPManager keeps one read-only connection to protein_info.sqlite3 for all
+# of its queries. Queries return iterators of Protein (or Change) records,
+# which are read from the database as they are consumed. Errors are raised
+# (sqlite3.Error, ValueError, update.UpdateError) instead of quitting.
+#
+# The modules of update are imported only by MPManager.update.
+
+import collections
+import os
+import sqlite3
+import urllib.parse
+
+import constants
+import iterator_tools
+import pickout
+
+
+# columns of protein_csv (see update.build_protein_csv)
+protein_fields = [
+        "pdb_id", "chain_id", "uniprot_ac", "protein_names", "gene_names",
+        "organism", "kegg_id", "mito_id", "gene_id", "resolution", "length"]
+
+Protein = collections.namedtuple("Protein", protein_fields)
+
+# row of MPManager.changes: change ("added", "changed" or "removed"), version
+# in which the change was made, and the columns of protein_csv
+Change = collections.namedtuple("Change", ["change", "version"] + protein_fields)
+
+def checked_filters(filters):
+    # filters ({name: value}) for pickout.filter_conditions. Filters are
+    # named as in pickout.filter_columns; ID and organism filters take a
+    # value or a list of values.
+    checked = {}
+    for name, value in filters.items():
+        if name not in pickout.filter_columns:
+            raise ValueError("unknown filter %s (choose from %s)" % (
+                name, ", ".join(sorted(pickout.filter_columns))))
+        kind = pickout.filter_columns[name][1]
+        if kind in ("in", "prefix") and isinstance(value, (str, int)):
+            value = [value]
+        checked[name] = value
+    return checked
+
+
+class MPManager:
+    # path : database (constants.sqlite3_dbpath if None), which is also the
+    #        database written by update
+    #
+    # The connection is opened by the first query, so that an MPManager can
+    # be made before the first update. In WAL mode, every query sees the
+    # latest version published by an update, without reconnecting.
+    def __init__(self, path=None):
+        self.path = os.path.abspath(path or constants.sqlite3_dbpath)
+        self.conn = None
+
+    def connection(self):
+        # (in autocommit mode, so that no transaction left open by
+        # pickout.select_chains keeps an old version in view)
+        if self.conn is None:
+            self.conn = sqlite3.connect(
+                    "file:%s?mode=ro" % urllib.parse.quote(self.path),
+                    uri=True, isolation_level=None)
+        return self.conn
+
+    def version(self):
+        # Version of the data (counted up by every update)
+        return self.connection().execute(
+                "PRAGMA user_version").fetchone()[0]
+
+    def proteins(self, **filters):
+        # Rows of protein_csv which match filters (see checked_filters), all
+        # rows if none
+        return map(Protein._make, pickout.select_filtered(
+            self.connection(), checked_filters(filters)))
+
+    def lookup_chains(self, chains, **filters):
+        # Rows of protein_csv for chains (iterator of PDB chain names such
+        # as 1A02_A), which also match filters (as in proteins).
+        # Chains are looked up in batches of constants.pickout_chunk_size,
+        # and the rows of a batch are read at once, so that several lookups
+        # can be iterated at the same time. A chain given twice in a batch is
+        # looked up once.
+        filters = checked_filters(filters)
+        self.connection()
+        return (Protein._make(row)
+                for batch in iterator_tools.split_iterator(
+                    chains, constants.pickout_chunk_size)
+                for row in self.lookup_batch(batch, filters))
+
+    def lookup_batch(self, chains, filters):
+        # Rows of a batch of lookup_chains. The chains are stored in one
+        # transaction (in autocommit mode, each of them would be a
+        # transaction of its own).
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            return pickout.select_chains(conn, chains, filters).fetchall()
+        finally:
+            conn.execute("COMMIT")
+
+    def changes(self, since):
+        # Rows of protein_csv added, changed or removed after version since
+        # (see pickout.select_since)
+        return map(Change._make,
+                   pickout.select_since(self.connection(), since))
+
+    def update(self, progress=None, **options):
+        # Update the database (see update.update_sqlite3db for options and
+        # progress) and return the new version. Nothing is logged unless
+        # the caller adds handlers to the "update" logger (or calls
+        # update.setup_logging).
+        import update
+        update.update_sqlite3db(
+                progress=progress, db_path=self.path, **options)
+        return self.version()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -29,54 +29,227 @@ import sqlite3
 import sys
 
 import constants
+import iterator_tools
+import snapshot
 
 
 def retrieve_all_data():
+    # protein_csv is built at the end of the update (see update.py).
+    #
+    # columns:
+    #
+    # pdb_id | chain_id | uniprot_ac | protein_names | gene_names | organism | kegg_id | mito_id | gene_id | resolution | length
+    # -------+----------+------------+---------------+------------+----------+---------+---------+---------+------------+-------
     try:
         with sqlite3.connect(constants.sqlite3_dbpath) as conn:
             cursor = conn.cursor()
-            query = (
-                    "CREATE VIEW IF NOT EXISTS protein_csv AS\n"
-                    "SELECT DISTINCT pdb_info.pdb_id, "
-                    "chain_info.chain_id, uniprot_info.uniprot_ac, "
-                    "uniprot_info.protein_names, uniprot_info.gene_names, "
-                    "uniprot_info.organism, uniprot_kegg.kegg_id, "
-                    "mitoproteome.mito_id, gene_uniprot.gene_id\n"
-                    "FROM pdb_info, chain_info, uniprot_info, uniprot_pdb, "
-                    "uniprot_kegg, mitoproteome, gene_uniprot\n"
-                    "WHERE mitoproteome.gene_id = gene_uniprot.gene_id\n"
-                    "AND gene_uniprot.uniprot_ac = uniprot_info.uniprot_ac\n"
-                    "AND gene_uniprot.uniprot_ac = uniprot_pdb.uniprot_ac\n"
-                    "AND gene_uniprot.uniprot_ac = uniprot_kegg.uniprot_ac\n"
-                    "AND (SUBSTR(uniprot_kegg.kegg_id, 4, 1) = ':' AND "
-                    "SUBSTR(uniprot_kegg.kegg_id, 5) = gene_uniprot.gene_id OR "
-                    "SUBSTR(uniprot_kegg.kegg_id, 5, 1) = ':' AND "
-                    "SUBSTR(uniprot_kegg.kegg_id, 6) = gene_uniprot.gene_id)\n"
-                    "AND uniprot_pdb.pdb_id = pdb_info.pdb_id\n"
-                    "AND pdb_info.pdb_id = chain_info.pdb_id\n"
-                    "AND pdb_info.chain_id = chain_info.chain_id\n"
-                    "AND chain_info.uniprot_ac = uniprot_info.uniprot_ac"
-                    )
-            # view name: protein_csv
-            #
-            # columns:
-            #
-            # pdb_id | chain_id | uniprot_ac | protein_names | gene_names | organism | kegg_id | mito_id | gene_id
-            # -------+----------+------------+---------------+------------+----------+---------+---------+--------
-
-            cursor.execute(query)
-            query = "SELECT DISTINCT * FROM protein_csv" # Get all information
+            query = "SELECT * FROM protein_csv" # Get all information
             results = cursor.execute(query)
+    except sqlite3.Error as e:
+        sys.stderr.write("%s\n" % e)
+        quit(1)
+
+    return results
+
+def parse_chains(chains):
+    # "1A02_A" -> ("1A02", "A")
+    # Malformed names are skipped.
+    pairs = map(lambda s: tuple(s.strip().split("_", 1)), chains)
+    return filter(lambda t: len(t) == 2, pairs)
+
+# filter name : (column of protein_csv, kind of condition)
+#   "in" : the column is one of the given values
+#   "prefix" : the column starts with one of the given values
+#   "max" / "min" : the column is at most / at least the given value
+filter_columns = {
+        "uniprot" : ("uniprot_ac", "in"),
+        "gene_id" : ("gene_id", "in"),
+        "mito_id" : ("mito_id", "in"),
+        "kegg" : ("kegg_id", "in"),
+        "organism" : ("organism", "prefix"),
+        "max_resolution" : ("resolution", "max"),
+        "min_length" : ("length", "min"),
+        }
+
+def filter_conditions(filters):
+    # filters : {filter name: list of values ("in", "prefix") or a value
+    #           ("max", "min") or None} (see filter_columns)
+    #
+    # Return (SQL condition on protein_csv, parameters). Filters are combined
+    # with AND, and values of one filter with OR. Every condition is a
+    # comparison of an indexed column (see update.protein_csv_indexes), so
+    # that sqlite can look rows up in an index.
+    conditions = []
+    params = []
+    for name, value in sorted(filters.items()):
+        if value is None or value == []:
+            continue
+        column, kind = filter_columns[name]
+        if kind == "in":
+            conditions.append("protein_csv.%s IN (%s)" % (
+                column, ", ".join("?" for v in value)))
+            params.extend(value)
+        elif kind == "prefix":
+            # prefix <= column < prefix + the largest character
+            conditions.append("(%s)" % " OR ".join(
+                "protein_csv.%s >= ? AND protein_csv.%s < ?" % (column, column)
+                for v in value))
+            for v in value:
+                params.extend([v, v + "\U0010ffff"])
+        elif kind == "max":
+            conditions.append("protein_csv.%s <= ?" % column)
+            params.append(value)
+        else:
+            conditions.append("protein_csv.%s >= ?" % column)
+            params.append(value)
+    return " AND ".join(conditions) or "1", params
+
+# The select_* functions take an open connection and raise sqlite3.Error or
+# ValueError, so that they can be used from mp_manager.py. The pickout_*
+# functions open the database and quit on errors.
+
+def select_filtered(conn, filters):
+    # Rows of protein_csv which match filters (see filter_conditions)
+    condition, params = filter_conditions(filters)
+    return conn.execute(
+            "SELECT * FROM protein_csv WHERE %s" % condition, params)
+
+def pickout_filtered(filters):
+    try:
+        conn = sqlite3.connect(constants.sqlite3_dbpath)
+        results = select_filtered(conn, filters)
+    except sqlite3.Error as e:
+        sys.stderr.write("%s\n" % e)
+        quit(1)
+
+    return results
 
-            conn.commit()
+def select_chains(conn, chains, filters=None):
+    # chains : iterator of PDB chain names (1A02_A, 10GS_A, etc.)
+    # filters : conditions the rows must also match (see filter_conditions)
+    #
+    # The chains are loaded into an indexed temporary table in chunks and
+    # joined with protein_csv, so that neither the chains nor the results
+    # need to be held in memory. The table is emptied by the next call on
+    # the same connection, so the rows must be read before that.
+    cursor = conn.cursor()
+    cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS picked_chains ("
+            "pdb_id TEXT, chain_id TEXT, "
+            "PRIMARY KEY (pdb_id, chain_id)) WITHOUT ROWID"
+            )
+    cursor.execute("DELETE FROM picked_chains")
+    insert_query = "INSERT OR IGNORE INTO picked_chains VALUES (?, ?)"
+    for chunk in iterator_tools.split_iterator(
+            parse_chains(chains), constants.pickout_chunk_size):
+        cursor.executemany(insert_query, chunk)
+    condition, params = filter_conditions(filters or {})
+    query = (
+            "SELECT protein_csv.* FROM picked_chains, protein_csv\n"
+            "WHERE protein_csv.pdb_id = picked_chains.pdb_id\n"
+            "AND protein_csv.chain_id = picked_chains.chain_id\n"
+            "AND %s" % condition
+            )
+    return cursor.execute(query, params)
+
+def pickout_data(chains, filters=None):
+    try:
+        conn = sqlite3.connect(constants.sqlite3_dbpath)
+        results = select_chains(conn, chains, filters)
     except sqlite3.Error as e:
         sys.stderr.write("%s\n" % e)
         quit(1)
 
     return results
 
-def pickout_data(chain_list):
-    results = retrieve_all_data()
-    chain_list = [tuple(s.split("_")) for s in set(chain_list)]
-    # pick information on chains in chain_list out of all information
-    return filter(lambda t: (t[0], t[1]) in chain_list, results)
+# columns of protein_csv which identify a row (see select_since)
+key_columns = [
+        "pdb_id", "chain_id", "uniprot_ac", "kegg_id", "mito_id", "gene_id"]
+
+def select_since(conn, version):
+    # Rows of protein_csv which changed after version (see
+    # update.record_history), as (change, version of the change) + row:
+    #   "added" : the row is new
+    #   "changed" : the row replaces a row with the same key_columns
+    #   "removed" : the row has disappeared
+    # A row which disappeared and came back unchanged is not shown.
+    # Version 0 is the empty database, so all rows are added after it.
+    # Raise ValueError if the changes after version are not recorded.
+    cursor = conn.cursor()
+    current = cursor.execute("PRAGMA user_version").fetchone()[0]
+    start = cursor.execute(
+            "SELECT MIN(added) FROM protein_csv_history").fetchone()[0]
+    if version > current:
+        raise ValueError("version %d is newer than the data (version %d)"
+                         % (version, current))
+    if version != 0 and (start is None or version < start):
+        raise ValueError("changes are recorded since version %s" % start)
+    names = [row[1] for row in
+            cursor.execute("PRAGMA table_info(protein_csv)").fetchall()]
+    def columns(table):
+        return ", ".join("%s.%s" % (table, name) for name in names)
+    same_key = " AND ".join("old.%s = new.%s" % (name, name)
+                            for name in key_columns)
+    # new : rows in protein_csv which were added after version
+    # old : rows at version which were removed after it
+    new = "new.removed IS NULL AND new.added > :version"
+    old = "old.added <= :version AND old.removed > :version"
+    # the unary + keeps the (removed, added) index, which would
+    # scan every current row, out of the NOT EXISTS probe
+    probe = "+new.removed IS NULL AND +new.added > :version"
+    query = (
+            "SELECT CASE WHEN old.row_hash IS NULL THEN 'added' "
+            "ELSE 'changed' END, new.added, %s\n"
+            "FROM protein_csv_history AS new\n"
+            "LEFT JOIN protein_csv_history AS old ON %s AND %s\n"
+            "WHERE %s\n"
+            "AND (old.row_hash IS NULL OR old.row_hash != new.row_hash)\n"
+            "UNION ALL\n"
+            "SELECT 'removed', old.removed, %s\n"
+            "FROM protein_csv_history AS old\n"
+            "WHERE %s AND NOT EXISTS (SELECT 1 "
+            "FROM protein_csv_history AS new WHERE %s AND %s)"
+            % (columns("new"), same_key, old, new,
+                columns("old"), old, same_key, probe)
+            )
+    return cursor.execute(query, {"version" : version})
+
+def pickout_since(version):
+    try:
+        conn = sqlite3.connect(constants.sqlite3_dbpath)
+        results = select_since(conn, version)
+    except (sqlite3.Error, ValueError) as e:
+        sys.stderr.write("%s\n" % e)
+        quit(1)
+
+    return results
+
+def read_chains(f):
+    # Yield PDB chain names in file f (separated by whitespace)
+    for line in f:
+        for chain in line.split():
+            yield chain
+
+def open_snapshot(path):
+    try:
+        return snapshot.Snapshot(path)
+    except (OSError, ValueError, snapshot.SnapshotError) as e:
+        sys.stderr.write("%s\n" % e)
+        quit(1)
+
+def closing_rows(snap, rows):
+    # Yield rows (read from snap), and close snap once they are all read
+    # or the iteration is abandoned
+    with snap:
+        yield from rows
+
+def retrieve_all_snapshot(path):
+    # Same as retrieve_all_data, but reads the snapshot file path
+    # (see snapshot.py) instead of the database
+    snap = open_snapshot(path)
+    return closing_rows(snap, snap.all_rows())
+
+def pickout_snapshot(chains, path):
+    # Same as pickout_data, but reads the snapshot file path
+    snap = open_snapshot(path)
+    return closing_rows(snap, snap.lookup_chains(parse_chains(chains)))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import threading
+import time
+
+import constants
+
+
+class TokenBucket:
+    # Token bucket that allows `rate` acquisitions per second on average
+    # and at most `burst` acquisitions back to back.
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Block until a token is available and take it.
+        # Return the number of seconds spent waiting.
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                        self.burst,
+                        self.tokens + (now - self.timestamp) * self.rate
+                        )
+                self.timestamp = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class HostLimiter:
+    # Request rate and concurrency cap for one host.
+    def __init__(self, rate, burst, concurrency):
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+
+    def acquire(self):
+        # Wait for a free slot and a token, and take the slot
+        self.semaphore.acquire()
+        try:
+            self.bucket.acquire()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self):
+        self.semaphore.release()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(host):
+    # Return the limiter of host, creating it from constants.host_limits.
+    with _limiters_lock:
+        if host not in _limiters:
+            params = constants.host_limits.get(
+                    host, constants.default_host_limit)
+            _limiters[host] = HostLimiter(
+                    params["rate"],
+                    params["burst"],
+                    params["concurrency"]
+                    )
+        return _limiters[host]
+
+def acquire_slot(host):
+    # Wait for a free slot of host and a token, and take the slot.
+    # Return the function which releases the slot; it must be called once
+    # the body of the response is read.
+    limiter = get_limiter(host)
+    limiter.acquire()
+    return limiter.release
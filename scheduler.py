@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Scheduler that runs tasks of a dependency graph concurrently.
+#
+# Each task runs in its own thread as soon as all the tasks it depends on are
+# ready. A task may declare itself ready before it finishes (for instance,
+# when its output table is created and the rest of its output will be
+# streamed), so that dependent tasks can start on partial results.
+
+import threading
+import time
+
+
+class Aborted(Exception):
+    # Raised by a task which stops because another task failed
+    pass
+
+
+class Task:
+    # name : str
+    # run : function called as run(ready, aborted)
+    #       ready : function to call when dependent tasks may start
+    #               (called automatically when run returns)
+    #       aborted : threading.Event which is set when another task fails
+    # deps : names of the tasks this task depends on
+    def __init__(self, name, run, deps=()):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+
+
+def run_tasks(tasks):
+    # Run tasks and return {task name: (start, end)} in seconds from the
+    # start of the scheduler. If a task raises an exception, the other tasks
+    # are aborted and the exception is raised again after all threads end.
+    ready = {task.name: threading.Event() for task in tasks}
+    aborted = threading.Event()
+    timings = {}
+    errors = []
+    origin = time.monotonic()
+
+    def run_task(task):
+        for dep in task.deps:
+            while not ready[dep].wait(0.1):
+                if aborted.is_set():
+                    return
+        if aborted.is_set():
+            return
+        start = time.monotonic() - origin
+        try:
+            task.run(ready[task.name].set, aborted)
+        except Aborted:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            aborted.set()
+        finally:
+            ready[task.name].set()
+            timings[task.name] = (start, time.monotonic() - origin)
+
+    threads = [
+            threading.Thread(target=run_task, args=(task,), name=task.name)
+            for task in tasks
+            ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        # e.g. KeyboardInterrupt in the main thread
+        aborted.set()
+        for thread in threads:
+            thread.join()
+        raise
+    if errors:
+        raise errors[0]
+    return timings
+
+def critical_path(tasks, timings):
+    # Return the names of the tasks on the critical path: starting from the
+    # task which ended last, follow the dependency which ended last.
+    by_name = {task.name: task for task in tasks}
+    path = []
+    names = [name for name in timings]
+    while names:
+        name = max(names, key=lambda n: timings[n][1])
+        path.append(name)
+        names = [dep for dep in by_name[name].deps if dep in timings]
+    path.reverse()
+    return path
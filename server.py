@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Lookup daemon (main.py serve).
+#
+# protein_csv is loaded once into dictionaries keyed by PDB chain, UniProt AC,
+# Gene ID and Mito ID, so that a lookup needs no database access. The index is
+# rebuilt in the background when an update publishes a new version of the
+# database (see bulk_load.py), and replaced as a whole, so lookups never see
+# a partially loaded index.
+#
+# Requests and responses are JSON objects:
+#   {"op": "lookup", "by": "chain", "keys": ["1A02_A", "10GS_A"]}
+#       -> {"version": 3, "rows": [[...], ...]}
+#   {"op": "status"} -> {"version": 3, "rows": 12345}
+#   (errors) -> {"error": "message"}
+# Over a Unix socket, every request and response is one line, and a
+# connection can send any number of requests. Over HTTP, a request is the body
+# of POST /lookup (or GET /status).
+
+import http.server
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import stat
+import sys
+import threading
+import time
+
+import constants
+
+
+# name of lookup : positions of the key columns in the rows of protein_csv
+#                  (several columns are joined by "_" as in "1A02_A")
+lookup_keys = {
+        "chain" : (0, 1),
+        "uniprot" : (2,),
+        "mito_id" : (7,),
+        "gene_id" : (8,),
+        }
+
+class Index:
+    # rows : rows of protein_csv
+    # version : version of the database the rows were read from
+    def __init__(self, rows, version):
+        self.version = version
+        self.n_rows = 0
+        self.maps = {by: {} for by in lookup_keys}
+        for row in rows:
+            self.n_rows += 1
+            for by, positions in lookup_keys.items():
+                values = [row[i] for i in positions]
+                if None in values:
+                    continue
+                key = "_".join(map(str, values))
+                self.maps[by].setdefault(key, []).append(row)
+
+    def lookup(self, by, keys):
+        # Rows of keys (each key once) in the order of keys
+        key_map = self.maps[by]
+        rows = []
+        for key in dict.fromkeys(keys):
+            rows.extend(key_map.get(key, ()))
+        return rows
+
+def database_stamp():
+    # (inode, version) of the database, which changes when an update
+    # finishes or the file is replaced
+    st = os.stat(constants.sqlite3_dbpath)
+    conn = sqlite3.connect(
+            "file:%s?mode=ro" % constants.sqlite3_dbpath, uri=True)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    return (st.st_ino, version)
+
+def load_index():
+    conn = sqlite3.connect(
+            "file:%s?mode=ro" % constants.sqlite3_dbpath, uri=True)
+    try:
+        # Rows and version are read in one transaction, so that they match
+        # even if an update finishes meanwhile.
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        index = Index(cursor.execute("SELECT * FROM protein_csv"), version)
+        cursor.execute("COMMIT")
+    finally:
+        conn.close()
+    return index
+
+class Lookup:
+    # Index of the current version of the database
+    def __init__(self):
+        self.stamp = database_stamp()
+        self.index = load_index()
+
+    def watch(self, interval):
+        # Reload the index when the database changes (runs in a thread).
+        # The former index keeps answering until the new one is loaded.
+        while True:
+            time.sleep(interval)
+            try:
+                stamp = database_stamp()
+                if stamp == self.stamp:
+                    continue
+                index = load_index()
+            except (OSError, sqlite3.Error) as e:
+                sys.stderr.write("reload failed: %s\n" % e)
+                continue
+            self.stamp = stamp
+            self.index = index
+            sys.stderr.write("loaded version %d (%d rows)\n"
+                             % (index.version, index.n_rows))
+
+    def answer(self, request):
+        # Response to request (dictionaries decoded from / encoded to JSON)
+        index = self.index
+        op = request.get("op", "lookup")
+        if op == "status":
+            return {"version": index.version, "rows": index.n_rows}
+        if op != "lookup":
+            return {"error": "unknown op: %s" % op}
+        by = request.get("by", "chain")
+        if not isinstance(by, str) or by not in lookup_keys:
+            return {"error": "unknown lookup: %s" % by}
+        keys = request.get("keys", [])
+        if not isinstance(keys, list) or not all(
+                isinstance(k, (str, int)) and not isinstance(k, bool)
+                for k in keys):
+            return {"error": "keys must be a list of strings or integers"}
+        return {"version": index.version,
+                "rows": index.lookup(by, map(str, keys))}
+
+    def answer_json(self, data):
+        try:
+            request = json.loads(data)
+        except ValueError as e:
+            return json.dumps({"error": "invalid request: %s" % e})
+        if not isinstance(request, dict):
+            return json.dumps({"error": "invalid request"})
+        return json.dumps(self.answer(request), ensure_ascii=False)
+
+def internal_error(e):
+    # Response to a request which failed unexpectedly (the server keeps
+    # serving other requests)
+    sys.stderr.write("request failed: %r\n" % e)
+    return json.dumps({"error": "internal error: %s" % e})
+
+class UnixHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.lookup.answer_json(line)
+            except Exception as e:
+                response = internal_error(e)
+            self.wfile.write(response.encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+class HTTPHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, response):
+        body = response.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_answer(self, data):
+        try:
+            response = self.server.lookup.answer_json(data)
+        except Exception as e:
+            self.send_json(500, internal_error(e))
+            return
+        self.send_json(200, response)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self.send_answer('{"op": "status"}')
+        else:
+            self.send_json(404, json.dumps({"error": "not found"}))
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.send_json(400, json.dumps({"error": "invalid Content-Length"}))
+            return
+        data = self.rfile.read(length)
+        if self.path == "/lookup":
+            self.send_answer(data)
+        else:
+            self.send_json(404, json.dumps({"error": "not found"}))
+
+    def log_message(self, format, *args):
+        # Requests are not logged
+        pass
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def stale_socket_error(path):
+    # None if path is a Unix socket on which no server is listening,
+    # otherwise the reason why it must not be removed
+    try:
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            return "%s exists and is not a socket" % path
+    except OSError as e:
+        return str(e)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return None
+    except OSError as e:
+        return "%s: %s" % (path, e)
+    finally:
+        sock.close()
+    return "a server is already listening on %s" % path
+
+def serve(socket_path=None, port=None):
+    # Serve lookups over HTTP on localhost:port if port is given, otherwise
+    # over the Unix socket socket_path (constants.serve_socket_path if None).
+    try:
+        lookup = Lookup()
+    except (OSError, sqlite3.Error) as e:
+        sys.stderr.write("%s\n" % e)
+        quit(1)
+    watcher = threading.Thread(
+            target=lookup.watch,
+            args=(constants.serve_poll_interval,),
+            daemon=True
+            )
+    watcher.start()
+
+    if port is not None:
+        server = http.server.ThreadingHTTPServer(
+                ("127.0.0.1", port), HTTPHandler)
+        address = "http://127.0.0.1:%d" % port
+    else:
+        if socket_path is None:
+            socket_path = constants.serve_socket_path
+        # A socket left by a former server is removed, but not a socket on
+        # which a server is running nor a file which is not a socket
+        if os.path.lexists(socket_path):
+            error = stale_socket_error(socket_path)
+            if error is not None:
+                sys.stderr.write("%s\n" % error)
+                quit(1)
+            os.remove(socket_path)
+        server = UnixServer(socket_path, UnixHandler)
+        address = socket_path
+    server.lookup = lookup
+    sys.stderr.write("serving version %d (%d rows) at %s\n"
+                     % (lookup.index.version, lookup.index.n_rows, address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if port is None:
+            os.remove(socket_path)
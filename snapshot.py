@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Memory-mapped snapshot of protein_csv.
+#
+# A snapshot is a read-only file which pickout can use without sqlite. It is
+# mapped into memory with mmap, so opening it costs almost nothing, and its
+# pages are shared by all processes reading it through the page cache.
+#
+# Layout (all integers in native byte order, every section aligned to 8 bytes):
+#
+#   header : magic, byte order check, version of the data, number of rows,
+#            number of strings
+#   string offsets : n_strings + 1 uint64, string i is
+#                    blob[offsets[i]:offsets[i + 1]] (UTF-8)
+#   one array per column of protein_csv (n_rows items each):
+#       string columns : uint32 string index (no_string for NULL)
+#       int64 columns : int64 (no_int for NULL)
+#       double columns : double (NaN for NULL)
+#   blob : distinct strings of all columns (each stored once)
+#
+# Rows are sorted by (pdb_id, chain_id), so chains are found by binary search.
+
+import array
+import math
+import mmap
+import os
+import struct
+
+import export
+
+
+magic = b"MPSNAP2\0"
+byte_order_check = 0x01020304
+header_format = "=8sIIQQ"
+header_size = 64
+no_string = 0xFFFFFFFF
+no_int = -2 ** 63
+
+# array typecode of each column (in the order of export.columns)
+typecodes = [{"int64" : "q", "double" : "d"}.get(t, "I")
+        for _, t in export.columns]
+
+def aligned(n):
+    return (n + 7) // 8 * 8
+
+def write_snapshot(cursor, path, version):
+    # Write protein_csv (read with cursor) to the snapshot file path.
+    # The file is written beside path and renamed, so that processes which
+    # have the former snapshot open keep reading it.
+    strings = {}
+    columns = [array.array(t) for t in typecodes]
+    rows = cursor.execute(
+            "SELECT * FROM protein_csv ORDER BY pdb_id, chain_id")
+    n_rows = 0
+    for row in rows:
+        n_rows += 1
+        for value, column in zip(row, columns):
+            if column.typecode == "q":
+                column.append(no_int if value is None else int(value))
+            elif column.typecode == "d":
+                column.append(math.nan if value is None else float(value))
+            elif value is None:
+                column.append(no_string)
+            else:
+                column.append(strings.setdefault(str(value), len(strings)))
+
+    offsets = array.array("Q", [0])
+    blob = bytearray()
+    for s in strings: # in the order of their indexes
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        header = struct.pack(header_format, magic, byte_order_check,
+                             version, n_rows, len(strings))
+        f.write(header.ljust(header_size, b"\0"))
+        for section in [offsets] + columns:
+            data = section.tobytes()
+            f.write(data.ljust(aligned(len(data)), b"\0"))
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return n_rows
+
+class SnapshotError(Exception):
+    pass
+
+class Snapshot:
+    # Read-only view of a snapshot file
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < header_size:
+            raise SnapshotError("%s is not a snapshot" % path)
+        (file_magic, check, self.version, self.n_rows,
+                n_strings) = struct.unpack_from(header_format, self.map)
+        if file_magic != magic:
+            raise SnapshotError("%s is not a snapshot" % path)
+        if check != byte_order_check:
+            raise SnapshotError(
+                    "%s was written on a machine of another byte order" % path)
+
+        view = memoryview(self.map)
+        position = header_size
+        def section(typecode, n):
+            nonlocal position
+            size = array.array(typecode).itemsize * n
+            if position + size > len(self.map):
+                raise SnapshotError("%s is truncated" % path)
+            data = view[position:position + size].cast(typecode)
+            position += aligned(size)
+            return data
+        self.offsets = section("Q", n_strings + 1)
+        self.columns = [section(t, self.n_rows) for t in typecodes]
+        self.blob = view[position:]
+
+    def string(self, i):
+        if i == no_string:
+            return None
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def value(self, column, i):
+        v = column[i]
+        if column.format == "q":
+            return None if v == no_int else v
+        if column.format == "d":
+            return None if math.isnan(v) else v
+        return self.string(v)
+
+    def row(self, i):
+        return tuple(self.value(c, i) for c in self.columns)
+
+    def chain_key(self, i):
+        return (self.string(self.columns[0][i]),
+                self.string(self.columns[1][i]))
+
+    def find_chain(self, key):
+        # Index of the first row of key (pdb_id, chain_id)
+        low, high = 0, self.n_rows
+        while low < high:
+            middle = (low + high) // 2
+            if self.chain_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup_chains(self, keys):
+        # Rows of keys (pdb_id, chain_id), each key once
+        for key in dict.fromkeys(keys):
+            i = self.find_chain(key)
+            while i < self.n_rows and self.chain_key(i) == key:
+                yield self.row(i)
+                i += 1
+
+    def all_rows(self):
+        for i in range(self.n_rows):
+            yield self.row(i)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Release the views before the map (mmap refuses to close otherwise)
+        self.offsets.release()
+        for c in self.columns:
+            c.release()
+        self.blob.release()
+        self.map.close()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Tests of mp_manager.py against the stand-in servers of
+# benchmarks/mock_servers.py
+#
+# usage: python3 -m unittest discover tests
+
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.join(tests_dir, "..")
+sys.path.insert(0, package_dir)
+sys.path.insert(0, os.path.join(package_dir, "benchmarks"))
+
+import constants
+import mock_servers
+import mp_manager
+
+
+class MPManagerUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.server = mock_servers.start(200)
+        mock_servers.point_constants(constants, self.server.server_port)
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_update_non_default_path(self):
+        os.mkdir("data")
+        path = os.path.join("data", "x.sqlite3")
+        progress = []
+        with mp_manager.MPManager(path) as manager:
+            version = manager.update(
+                    progress=lambda *args: progress.append(args),
+                    use_cache=False)
+            self.assertEqual(version, 1)
+            self.assertEqual(progress[-1][0], "protein_csv")
+            n_rows = progress[-1][1]
+            self.assertGreater(n_rows, 0)
+            self.assertEqual(len(list(manager.proteins())), n_rows)
+            chains = ["%s_%s" % protein[:2] for protein in manager.proteins()]
+            self.assertEqual(len(list(manager.lookup_chains(chains))), n_rows)
+            self.assertEqual(manager.update(use_cache=False), 2)
+        # nothing is written to the default database, and no log handlers
+        # are installed
+        self.assertFalse(os.path.exists(constants.sqlite3_dbpath))
+        self.assertFalse(os.path.exists(constants.logfile))
+        self.assertEqual(logging.getLogger("update").handlers, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# written in Python3
+
+
+# MIT License
+#
+# Copyright (c) 2018 Hiroki Watanabe
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Tests of the update against the stand-in servers of benchmarks/mock_servers.py
+#
+# usage: python3 -m unittest discover tests
+
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.join(tests_dir, "..")
+sys.path.insert(0, package_dir)
+sys.path.insert(0, os.path.join(package_dir, "benchmarks"))
+
+import constants
+import mock_servers
+
+
+class MitoTableTest(unittest.TestCase):
+    def setUp(self):
+        self.server = mock_servers.start(300)
+        mock_servers.point_constants(constants, self.server.server_port)
+        self.page_size = constants.mito_table_page_size
+        constants.mito_table_page_size = 100
+        import update
+        self.update = update
+        update.http_cache.configure(False, False)
+
+    def tearDown(self):
+        constants.mito_table_page_size = self.page_size
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_malformed_row_does_not_end_paging(self):
+        # The row of MITO50, in the middle of the full first page, lacks its
+        # Gene ID anchor
+        mito_table = self.server.data.mito_table
+        def malformed_table(nums, page):
+            for piece in mito_table(nums, page):
+                if ">MITO50<" in piece:
+                    piece = re.sub(r"<a href=\"http://www\.ncbi[^>]*>"
+                                   r"([^<]*)</a>", r"\1", piece)
+                yield piece
+        self.server.data.mito_table = malformed_table
+        with self.assertLogs("update", "WARNING") as logs:
+            pairs = list(self.update.get_mito_id_gene_id_pairs())
+        self.assertEqual(len(pairs), 299)
+        self.assertNotIn("MITO50", [mito_id for mito_id, _ in pairs])
+        self.assertIn("MITO299", [mito_id for mito_id, _ in pairs])
+        self.assertTrue(any("row 51 skipped" in line for line in logs.output))
+        # pages 1 to 3 are full, and page 4 is empty
+        self.assertEqual(sum(self.server.counts.values()), 4)
+
+
+class LocalSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = mock_servers.start(100)
+        mock_servers.point_constants(constants, self.server.server_port)
+        import update
+        self.update = update
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def protein_csv(self, path):
+        with sqlite3.connect(path) as conn:
+            return sorted(conn.execute("SELECT * FROM protein_csv"))
+
+    def test_incremental_update_refetches_local_loads(self):
+        # Keys loaded from the dumps are not taken as fetched, so an online
+        # incremental update after a local load fetches the chains again
+        os.mkdir("dumps")
+        self.server.data.write_dumps("dumps")
+        self.update.update_sqlite3db(use_cache=False, db_path="online.sqlite3")
+        self.update.update_sqlite3db(
+                use_cache=False, source="local:dumps", db_path="x.sqlite3")
+        self.server.counts.clear()
+        self.update.update_sqlite3db(
+                use_cache=False, incremental=True, db_path="x.sqlite3")
+        self.assertGreater(self.server.counts.get("/pdb/rest/describeMol", 0), 0)
+        self.assertEqual(self.protein_csv("x.sqlite3"),
+                         self.protein_csv("online.sqlite3"))
+
+if __name__ == "__main__":
+    unittest.main()
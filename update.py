@@ -27,42 +27,83 @@
 # SOFTWARE.
 
 
+import cProfile
+import hashlib
+import io
+import json
+import os
+import pstats
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import urllib.parse
 import urllib3
 import time
 from itertools import chain
-import lxml.html
+import lxml.etree
 import xml.etree.ElementTree as ET
-import certifi
 import sqlite3
 import sys
+import threading
 from logging import getLogger
 from logging import FileHandler
 from logging import StreamHandler
 from logging import INFO
-from logging import basicConfig
 from logging import Formatter
 
+import bulk_load
 import constants
+import http_cache
+import http_session
+import instrument
 import iterator_tools
+import journal
+import local_source
+import rate_limit
+import scheduler
+import snapshot
 
-stream_logger = None
-file_logger = None
+logger = getLogger("update")
 
-def replace_table(cursor, table_name, schema_params, tuples):
+def setup_logging():
+    # Log to standard output and constants.logfile.
+    # Handlers are added only once even if the update runs several times.
+    if logger.handlers:
+        return
+    logformat = Formatter(
+            "[%(asctime)s] %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S"
+            )
+    for handler in [StreamHandler(stream=sys.stdout),
+                    FileHandler(constants.logfile)]:
+        handler.setFormatter(logformat)
+        logger.addHandler(handler)
+    logger.setLevel(INFO)
+
+def replace_table(cursor, table_name, schema_params, tuples,
+                  primary_key=None, without_rowid=False):
     # table_name : str
     # schema_params : dict (key: column name, value: type)
     # tuples : tuple list OR tuple iterator OR tuple set OR tuple tuple
+    # primary_key : list of column names, or None
+    #               (tuples with a duplicate primary key are ignored)
+    # without_rowid : whether the table is a WITHOUT ROWID table
+    #                 (primary_key is required)
     drop_query = "DROP TABLE IF EXISTS %s" % table_name
     cursor.execute(drop_query)
 
-    create_query = "CREATE TABLE IF NOT EXISTS %s (%s)" % (
+    definitions = ["%s %s" % t for t in schema_params]
+    if primary_key is not None:
+        definitions.append("PRIMARY KEY (%s)" % ", ".join(primary_key))
+    create_query = "CREATE TABLE IF NOT EXISTS %s (%s)%s" % (
             table_name,
-            ", ".join(
-                ("%s %s" % t for t in schema_params))
+            ", ".join(definitions),
+            " WITHOUT ROWID" if without_rowid else ""
             )
     cursor.execute(create_query)
 
-    insert_query = "INSERT INTO %s VALUES (%s)" % (
+    insert_query = "INSERT %sINTO %s VALUES (%s)" % (
+            "OR IGNORE " if primary_key is not None else "",
             table_name,
             ", ".join(
                 ("?" for i in range(len(schema_params))))
@@ -71,54 +112,240 @@ def replace_table(cursor, table_name, schema_params, tuples):
             )
     cursor.executemany(insert_query, tuples)
 
-def map_with_sleep(f, iterator, second=1):
-    # If type of iterator is not iterator, it will be converted to iterator.
-    if any(isinstance(iterator, c) for c in [list, set, tuple]):
-        iterator = iter(iterator)
-
-    yield f(next(iterator))
-    for item in iterator:
-        time.sleep(second)
-        yield f(item)
+def create_intern_table(cursor, table_name):
+    # Table which gives an integer ID to each distinct string (name), so
+    # that a repeated string is stored once and referred to by its ID.
+    # IDs never change and rows are never deleted, so intern tables are
+    # shared by the live and staging tables (they are not swapped).
+    cursor.execute(
+            "CREATE TABLE IF NOT EXISTS %s ("
+            "id INTEGER PRIMARY KEY, name TEXT UNIQUE)" % table_name
+            )
 
-def get_data_online(method, url, params):
+def open_data_online(method, url, params):
+    # Return a binary file object from which the response body can be read
+    # (and parsed) while it is downloaded.
     method_set = {"GET", "POST"}
     if method not in method_set:
         return None
 
-    with urllib3.PoolManager(
-            cert_reqs = "CERT_REQUIRED",
-            ca_certs = certifi.where()
-            ) as http:
-        stream_logger.info("Access to %s" % url)
-        file_logger.info("Access to %s" % url)
-        r = http.request(method, url, fields=params)
-        data = r.data.decode()
+    # Requests are instrumented by the path of url (see instrument.py)
+    parsed_url = urllib3.util.parse_url(url)
+    endpoint = parsed_url.path
+    entry = None
+    if http_cache.enabled:
+        key = http_cache.make_key(method, url, params)
+        entry = http_cache.lookup(key)
+        if entry is not None and (http_cache.offline or entry.is_fresh(url)):
+            instrument.count("http.cache_hits", endpoint)
+            return io.BytesIO(entry.body)
+        if http_cache.offline:
+            raise UpdateError("%s is not cached (offline mode)" % url)
+
+    http = http_session.get_session()
+    # Passing headers to request() replaces the session's default headers.
+    headers = dict(http.headers)
+    if entry is not None:
+        # Ask the server whether the stale cached response is still valid
+        headers.update(entry.validation_headers())
+
+    host = parsed_url.host
+    # Wait for the politeness limits of host (see rate_limit.py). The slot
+    # is held until the body is read (the reader is closed), so that the
+    # concurrency cap of host limits the downloads in progress.
+    wait_start = time.perf_counter()
+    release_slot = rate_limit.acquire_slot(host)
+    try:
+        start = time.perf_counter()
+        instrument.observe("sleep.rate_limit", host, start - wait_start)
+        logger.info("Access to %s" % url)
+        r = http.request(
+                method, url, fields=params, headers=headers,
+                preload_content=False
+                )
+    except BaseException:
+        release_slot()
+        raise
+    # time until the response headers are received
+    instrument.observe(
+            "http.latency", endpoint, time.perf_counter() - start)
+    instrument.count("http.requests", endpoint)
+    instrument.count("http.status", str(r.status))
+
+    if entry is not None and r.status == 304: # Not Modified
+        r.release_conn()
+        release_slot()
+        http_cache.touch(entry.key)
+        instrument.count("http.not_modified", endpoint)
+        return io.BytesIO(entry.body)
+    if r.status != 200:
+        try:
+            r.drain_conn()
+            r.release_conn()
+        finally:
+            release_slot()
+        raise ResponseError(url, r.status)
+    def on_close(n_bytes):
+        release_slot()
+        instrument.count("http.bytes", endpoint, n_bytes)
+        instrument.observe(
+                "http.response_seconds", endpoint, time.perf_counter() - start)
+    recorder = None
+    if http_cache.enabled:
+        recorder = http_cache.Recorder(
+                key, url,
+                r.headers.get("ETag"),
+                r.headers.get("Last-Modified")
+                )
+    return io.BufferedReader(
+            http_session.ResponseReader(r, recorder, on_close))
+
+class ResponseError(Exception):
+    # The server returned an error status.
+    def __init__(self, url, status):
+        Exception.__init__(self, "%s returned status %d" % (url, status))
+        self.url = url
+        self.status = status
+
+def iter_tsv_rows(stream, n_columns):
+    # Yield each line (except the header line) of tab-separated binary
+    # stream as a tuple, while the stream is read.
+    # Lines which do not have n_columns columns are skipped.
+    lines = io.TextIOWrapper(stream, encoding="utf-8", newline="\n")
+    next(lines, None) # header line
+    n_rows = 0
+    for line in lines:
+        t = tuple(line.rstrip("\r\n").split("\t"))
+        if len(t) == n_columns:
+            n_rows += 1
+            yield t
+    instrument.count("parse.rows", "tsv", n_rows)
+
+def iterparse_elements(stream, tag):
+    # Yield each element named tag in XML stream as soon as it is closed.
+    # Yielded elements are cleared afterwards to keep memory usage flat.
+    context = ET.iterparse(stream, events=("start", "end"))
+    _, root = next(context)
+    n_elements = 0
+    for event, elem in context:
+        if event == "end" and elem.tag == tag:
+            n_elements += 1
+            yield elem
+            elem.clear()
+            root.clear()
+    instrument.count("parse.rows", tag, n_elements)
+
+class MitoTableTarget:
+    # lxml parser target which collects (Mito ID, Gene ID) of each row of
+    # the MitoProteome table while the page is parsed.
+    # Both IDs are taken from the anchors of the same <tr>, so a row
+    # lacking one of them is skipped (with a warning) instead of shifting
+    # the pairs. n_rows counts all data rows (rows with <td>), including
+    # the skipped ones.
+    def __init__(self):
+        self.pairs = []
+        self.n_rows = 0
+        self.row = None
+        self.href = None
+        self.text = []
+
+    def start(self, tag, attrib):
+        if tag == "tr":
+            self.row = {}
+        elif tag == "td" and self.row is not None:
+            self.row["td"] = True
+        elif tag == "a" and self.row is not None:
+            self.href = attrib.get("href", "")
+            self.text = []
 
-    return data
+    def data(self, data):
+        if self.href is not None:
+            self.text.append(data)
+
+    def end(self, tag):
+        if tag == "a" and self.href is not None:
+            text = "".join(self.text).strip()
+            if constants.mito_detail_php in self.href:
+                self.row.setdefault("mito_id", text)
+            elif constants.entrez_gene_record_url in self.href:
+                self.row.setdefault("gene_id", text)
+            self.href = None
+        elif tag == "tr" and self.row is not None:
+            if "td" in self.row:
+                self.n_rows += 1
+                if "mito_id" in self.row and "gene_id" in self.row:
+                    self.pairs.append(
+                            (self.row["mito_id"], self.row["gene_id"]))
+                else:
+                    logger.warning(
+                            "mitoproteome: row %d skipped (Mito ID: %s, "
+                            "Gene ID: %s)" % (self.n_rows,
+                                self.row.get("mito_id", "missing"),
+                                self.row.get("gene_id", "missing")))
+            self.row = None
+
+    def close(self):
+        pass
+
+def iter_mito_table_rows(stream, target=None):
+    # Yield (Mito ID, Gene ID) of each row of a MitoProteome table page in
+    # binary stream, while the stream is read.
+    # target : MitoTableTarget, which counts the rows of the page
+    #          (a new one if None)
+    if target is None:
+        target = MitoTableTarget()
+    parser = lxml.etree.HTMLParser(target=target)
+    n_rows = 0
+    while True:
+        data = stream.read(65536)
+        if not data:
+            break
+        parser.feed(data)
+        n_rows += len(target.pairs)
+        yield from target.pairs
+        target.pairs.clear()
+    parser.close()
+    n_rows += len(target.pairs)
+    yield from target.pairs
+    instrument.count("parse.rows", "mitoproteome", n_rows)
 
 def get_mito_id_gene_id_pairs():
     # Collect Mito IDs and Gene IDs of genes recorded in [MitoProteome](http://www.mitoproteome.org).
-    params = {
-            "nums" : "10000",
-            }
-    data = get_data_online("POST", constants.mito_table_url, params)
-    root = lxml.html.fromstring(data)
-    anchors = root.xpath("//a")
-    mito_id_anchors = filter(
-            lambda anchor:
-            constants.mito_detail_php in anchor.attrib["href"],
-            anchors
-            )
-    gene_id_anchors = filter(
-            lambda anchor:
-            constants.entrez_gene_record_url in anchor.attrib["href"],
-            anchors
-            )
-    mito_ids = map(lambda anchor: anchor.text, mito_id_anchors)
-    gene_ids = map(lambda anchor: anchor.text, gene_id_anchors)
-    return zip(mito_ids, gene_ids)
-
+    # The table is requested page by page until a page has fewer data rows
+    # than the page size (rows skipped by MitoTableTarget are counted, so
+    # that a malformed row does not end paging).
+    # If the server ignores the page parameter (the first row of a page is
+    # that of the first page), only the rows of the first page are taken,
+    # as before paging, and a warning is logged because the table may have
+    # more rows.
+    size = constants.mito_table_page_size
+    first_pair = None
+    page = 1
+    while True:
+        params = {
+                "nums" : str(size),
+                constants.mito_table_page_param : str(page),
+                }
+        n_pairs = 0
+        target = MitoTableTarget()
+        with open_data_online("POST", constants.mito_table_url, params) as stream:
+            for pair in iter_mito_table_rows(stream, target):
+                if n_pairs == 0:
+                    if pair == first_pair:
+                        logger.warning(
+                                "mitoproteome: page %d repeats page 1, "
+                                "the server ignores the %s parameter; "
+                                "only the first %d rows are taken"
+                                % (page, constants.mito_table_page_param,
+                                    size))
+                        return
+                    if first_pair is None:
+                        first_pair = pair
+                n_pairs += 1
+                yield pair
+        if target.n_rows < size:
+            return
+        page += 1
 
 def get_uniprot_info(accs):
     # Map each UniProt AC to the following things:
@@ -142,13 +369,9 @@ def get_uniprot_info(accs):
             "columns" : ",".join(columns),
             "format" : "tab",
             }
-    data = get_data_online("GET", constants.uniprot_url, params)
-    info_lines = data.split("\n")[1:]
-    return filter(
-            lambda t:
-            len(t) == 4,
-            map(lambda s: tuple(s.split("\t")), info_lines)
-            )
+    with open_data_online("GET", constants.uniprot_url, params) as stream:
+        for t in iter_tsv_rows(stream, 4):
+            yield t
 
     # return (UniProt AC, protein names, gene names, organism)
     #
@@ -166,20 +389,9 @@ def map_id(iterator, from_abbrev, to_abbrev):
             "format" : "tab",
             "query" : ",".join(iterator),
             }
-    data = get_data_online("GET", constants.uniprot_mapping_url, params).strip()
-    info_line = data.split("\n")[1:]
-    return filter(
-            lambda t:
-            len(t) == 2,
-            map(lambda s: tuple(s.split("\t")), info_line)
-            )
-
-def get_with_sleep(f, iterator, group_n=100):
-    # Take sleep in order to avoid server overload
-    #
-    # Split iterator in order to reduce data traffic per connection
-    return iterator_tools.concat_iterator(
-            *map_with_sleep(f, iterator_tools.split_iterator(iterator, group_n)))
+    with open_data_online("GET", constants.uniprot_mapping_url, params) as stream:
+        for t in iter_tsv_rows(stream, 2):
+            yield t
 
 def get_uniprot_acs(gene_ids):
     # Map Gene IDs to UniProt ACs.
@@ -191,56 +403,54 @@ def get_pdb_ids(accs):
 
 def get_kegg_id(accs):
     # Map each UniProt AC to KEGG ID
-    return map_id(accs, "ACC", "KEGG_ID")
+    #
+    # Yield (UniProt AC, KEGG ID, organism code, gene ID). The KEGG ID is
+    # split at the first ":" (e.g. "hsa:1000" -> "hsa", 1000), so that the
+    # gene ID can be joined with gene_uniprot.gene_id. Both are None if the
+    # KEGG ID has no ":".
+    for acc, kegg_id in map_id(accs, "ACC", "KEGG_ID"):
+        yield (acc, kegg_id) + split_kegg_id(kegg_id)
+
+def split_kegg_id(kegg_id):
+    # "hsa:1000" -> ("hsa", 1000), "hsa" -> (None, None)
+    organism, _, gene_id = kegg_id.partition(":")
+    if not gene_id:
+        return (None, None)
+    return (organism, int(gene_id) if gene_id.isdigit() else gene_id)
 
 def get_pdb_info(pdb_ids):
     # Get the following things of each PDB ID:
     #   * resolution
     #   * entity ID
     #   * chain ID
+    #
+    # Yield (PDB ID, resolution, entity ID, chain ID) for each chain of
+    # protein entities, while the response is parsed.
     url = constants.pdb_rest_url + "getEntityInfo"
     params = {
             "structureId" : ",".join(pdb_ids),
             }
-    xmldata = get_data_online("GET", url, params)
-    tree = ET.fromstring(xmldata)
-    pdb_nodes = tree.findall("PDB")
-    methods = map(
-            lambda node:
-            node.find("Method").attrib["name"],
-            pdb_nodes
-            )
-    resolutions = map(
-            lambda node, method:
-            node.attrib["resolution"] if (method == "xray" and "resolution" in set(node.attrib.keys())) else None,
-            pdb_nodes,
-            methods
-            )
-    pdb_ids = map(lambda node: node.attrib["structureId"], pdb_nodes)
-    entities = map(lambda node: node.findall("Entity"), pdb_nodes)
-    #protein_entities = ((e for e in elist if e.attrib["type"] == "protein") for elist in entities)
-    protein_entities = map(
-            lambda elist:
-            filter(lambda e:
-                e.attrib["type"] == "protein",
-                elist
-                ),
-            entities
-            )
-    entity_ids = map(
-            lambda elist:
-            [(e.attrib["id"],
-                [n.attrib["id"] for n in e.findall("Chain")])
-                for e in elist],
-            protein_entities
-            )
-    return zip(pdb_ids, resolutions, entity_ids)
+    with open_data_online("GET", url, params) as stream:
+        for node in iterparse_elements(stream, "PDB"):
+            method = node.find("Method").attrib["name"]
+            resolution = node.attrib.get("resolution") \
+                    if method == "xray" else None
+            pdb_id = node.attrib["structureId"]
+            for entity in node.iterfind("Entity"):
+                if entity.attrib["type"] != "protein":
+                    continue
+                for chain_node in entity.iterfind("Chain"):
+                    yield (pdb_id, resolution,
+                            entity.attrib["id"], chain_node.attrib["id"])
 
 def get_chain_info(chains):
     # Get the following things of PDB chain:
     #   * length of chain
     #   * accession (UniProt AC)
     # chains is like [("1JU5", "C"), ("2BID", "A"), ...] (iterator is OK).
+    #
+    # Yield (PDB ID, chain ID, length, UniProt AC or None) for each chain,
+    # while the response is parsed.
     url = constants.pdb_rest_url + "describeMol"
     params = {
             "structureId" : ",".join(
@@ -250,217 +460,1130 @@ def get_chain_info(chains):
                     )
                 ),
             }
-    xmldata = get_data_online("GET", url, params)
-    tree = ET.fromstring(xmldata)
-    structureId_nodes = tree.findall("structureId")
-    tuples = map(
-            lambda node:
-            (node.attrib["id"], # PDB ID
-                node.attrib["chainId"], # chain ID
-                node.find("polymer").attrib["length"], # length
-                (node.find("polymer")
-                    .find("macroMolecule")
-                    ) # macroMolecule's node or None
-                ),
-            structureId_nodes
+    with open_data_online("GET", url, params) as stream:
+        for node in iterparse_elements(stream, "structureId"):
+            polymer = node.find("polymer")
+            macro_molecule = polymer.find("macroMolecule") # node or None
+            yield (node.attrib["id"], # PDB ID
+                    node.attrib["chainId"], # chain ID
+                    polymer.attrib["length"], # length
+                    macro_molecule.find("accession").attrib["id"]
+                    if macro_molecule != None else None)
+
+
+def get_max_query_length(url):
+    # Limit of the encoded length of keys in a request to url
+    # (the longest matching URL prefix in constants.max_query_lengths)
+    prefixes = [p for p in constants.max_query_lengths if url.startswith(p)]
+    if not prefixes:
+        return constants.default_max_query_length
+    return constants.max_query_lengths[max(prefixes, key=len)]
+
+
+class Stage:
+    # One step of the update, which fills one table.
+    #
+    # name : str (name of the table filled by this stage)
+    # schema_params : list of (column name, type); the first key_n columns
+    #                 are the key of the input that each row was fetched for
+    # fetch : function that takes an iterator of input keys (or nothing if
+    #         input_query is None) and returns an iterator of rows
+    # input_query : query that selects the input keys from the tables filled
+    #               by the former stages, or None ({table name} is replaced
+    #               with the name of the table being loaded)
+    # key_n : number of columns of the key
+    # primary_key : column names of the primary key, which starts with the
+    #               key columns (rows with a duplicate primary key, e.g. from
+    #               overlapping requests, are ignored)
+    # without_rowid : whether the table is a WITHOUT ROWID table (for tables
+    #                 of short rows)
+    # interned : {column name: intern table}; the fetched string in the
+    #            column is stored as its ID in the intern table
+    #            (see create_intern_table)
+    # indexes : list of column lists indexed for the protein_csv join
+    #           (besides the primary key)
+    # url : URL requested by fetch (for the limit of the query length)
+    # key_text : function that returns the text which a key (as given to
+    #            fetch) adds to the query
+    # inputs : names of the stages whose tables input_query reads
+    # stream_key : function that returns the input key (tuple) in a row
+    #              fetched by the input stage, so that this stage can
+    #              start on the rows while the input stage is running
+    def __init__(self, name, schema_params, fetch, input_query=None, key_n=1,
+                 primary_key=None, without_rowid=False, interned=None,
+                 indexes=(), url=None, key_text=None,
+                 inputs=(), stream_key=None):
+        self.name = name
+        self.schema_params = schema_params
+        self.fetch = fetch
+        self.input_query = input_query
+        self.key_n = key_n
+        self.primary_key = primary_key
+        self.without_rowid = without_rowid
+        self.interned = interned or {}
+        self.indexes = indexes
+        self.url = url
+        self.key_text = key_text
+        self.inputs = list(inputs)
+        self.stream_key = stream_key
+
+    def key_columns(self):
+        return [column for column, _ in self.schema_params[:self.key_n]]
+
+    def key_indexed(self):
+        # Whether rows can be looked up by key without an extra index
+        primary_key = self.primary_key or []
+        return primary_key[:self.key_n] == self.key_columns()
+
+    def fetch_keys(self, batch):
+        # Convert keys recorded in the journal (lists of str) into keys
+        # given to fetch.
+        if self.key_n == 1:
+            return [k[0] for k in batch]
+        return [tuple(k) for k in batch]
+
+    def make_batcher(self):
+        # Batcher which sizes requests of this stage
+        return iterator_tools.AdaptiveBatcher(
+                constants.request_batch_size,
+                get_max_query_length(self.url),
+                key_cost=lambda key:
+                    len(urllib.parse.quote_plus(self.key_text(key))),
+                min_size=1
+                )
+
+
+stages = [
+        Stage(
+            "mitoproteome",
+            [("mito_id", "TEXT"), ("gene_id", "INTEGER")],
+            get_mito_id_gene_id_pairs,
+            primary_key=["mito_id", "gene_id"],
+            without_rowid=True,
+            indexes=[["gene_id"]]
+            ),
+        Stage(
+            "gene_uniprot",
+            [("gene_id", "INTEGER"), ("uniprot_ac", "TEXT")],
+            get_uniprot_acs,
+            "SELECT DISTINCT gene_id FROM {mitoproteome}",
+            primary_key=["gene_id", "uniprot_ac"],
+            without_rowid=True,
+            indexes=[["uniprot_ac"]],
+            url=constants.uniprot_mapping_url,
+            key_text=lambda gene_id: gene_id + ",",
+            inputs=["mitoproteome"],
+            stream_key=lambda row: (row[1],) # (mito_id, gene_id)
+            ),
+        Stage(
+            "uniprot_info",
+            [("uniprot_ac", "TEXT"), ("protein_names", "TEXT"),
+                ("gene_names", "TEXT"), ("organism_id", "INTEGER")],
+            get_uniprot_info,
+            "SELECT DISTINCT uniprot_ac FROM {gene_uniprot}",
+            primary_key=["uniprot_ac"],
+            interned={"organism_id" : "organisms"},
+            url=constants.uniprot_url,
+            key_text=lambda acc: "accession:" + acc + " OR ",
+            inputs=["gene_uniprot"],
+            stream_key=lambda row: (row[1],) # (gene_id, uniprot_ac)
+            ),
+        Stage(
+            "uniprot_pdb",
+            [("uniprot_ac", "TEXT"), ("pdb_id", "TEXT")],
+            get_pdb_ids,
+            "SELECT DISTINCT uniprot_ac FROM {gene_uniprot}",
+            primary_key=["uniprot_ac", "pdb_id"],
+            without_rowid=True,
+            indexes=[["pdb_id"]],
+            url=constants.uniprot_mapping_url,
+            key_text=lambda acc: acc + ",",
+            inputs=["gene_uniprot"],
+            stream_key=lambda row: (row[1],) # (gene_id, uniprot_ac)
+            ),
+        Stage(
+            "uniprot_kegg",
+            [("uniprot_ac", "TEXT"), ("kegg_id", "TEXT"),
+                ("kegg_organism", "TEXT"), ("kegg_gene_id", "INTEGER")],
+            get_kegg_id,
+            "SELECT DISTINCT uniprot_ac FROM {gene_uniprot}",
+            primary_key=["uniprot_ac", "kegg_id"],
+            without_rowid=True,
+            indexes=[["kegg_gene_id", "kegg_organism"]],
+            url=constants.uniprot_mapping_url,
+            key_text=lambda acc: acc + ",",
+            inputs=["gene_uniprot"],
+            stream_key=lambda row: (row[1],) # (gene_id, uniprot_ac)
+            ),
+        Stage(
+            "pdb_info",
+            [("pdb_id", "TEXT"), ("resolution", "REAL"),
+                ("entity_id", "INTEGER"), ("chain_id", "TEXT")],
+            get_pdb_info,
+            "SELECT DISTINCT pdb_id FROM {uniprot_pdb}",
+            primary_key=["pdb_id", "chain_id"],
+            without_rowid=True,
+            url=constants.pdb_rest_url + "getEntityInfo",
+            key_text=lambda pdb_id: pdb_id + ",",
+            inputs=["uniprot_pdb"],
+            stream_key=lambda row: (row[1],) # (uniprot_ac, pdb_id)
+            ),
+        Stage(
+            "chain_info",
+            [("pdb_id", "TEXT"), ("chain_id", "TEXT"),
+                ("length", "INTEGER"), ("uniprot_ac", "TEXT")],
+            get_chain_info,
+            "SELECT DISTINCT pdb_id, chain_id FROM {pdb_info}",
+            key_n=2,
+            primary_key=["pdb_id", "chain_id"],
+            without_rowid=True,
+            url=constants.pdb_rest_url + "describeMol",
+            key_text=lambda t: t[0] + "." + t[1] + ",",
+            inputs=["pdb_info"],
+            # (pdb_id, resolution, entity_id, chain_id)
+            stream_key=lambda row: (row[0], row[3])
+            ),
+        ]
+
+
+def table_exists(cursor, table_name):
+    query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return cursor.execute(query, (table_name,)).fetchone() is not None
+
+def create_fetch_state_table(cursor, table_name="fetch_state"):
+    # fetch_state records when the rows of each input key of each stage were
+    # fetched (key columns joined by tab).
+    cursor.execute(
+            "CREATE TABLE IF NOT EXISTS %s ("
+            "stage TEXT, key TEXT, fetched_at REAL, "
+            "PRIMARY KEY (stage, key))" % table_name
             )
-    return map(
-            lambda t: # t = (PDB ID, chain ID, length, node or None)
-            (t[0], t[1], t[2],
-                t[3].find("accession").attrib["id"] if t[3] != None else None),
-            tuples
+
+def loading_names():
+    # {table name: name of the table being loaded} for formatting queries
+    names = {stage.name: bulk_load.staging_name(stage.name)
+            for stage in stages}
+    names["fetch_state"] = bulk_load.staging_name("fetch_state")
+    return names
+
+class FetchError(Exception):
+    pass
+
+class UpdateError(Exception):
+    # The update cannot continue (reported by main.py, or raised to the
+    # caller of update_sqlite3db)
+    pass
+
+def is_size_error(e):
+    # Whether exception e suggests that the request was too large
+    # (the URL was too long or the server timed out)
+    if isinstance(e, ResponseError):
+        return e.status in constants.bisect_statuses
+    if isinstance(e, urllib3.exceptions.MaxRetryError):
+        e = e.reason
+    return isinstance(e, urllib3.exceptions.ReadTimeoutError)
+
+def fetch_bisecting(stage, batcher, keys):
+    # Fetch the rows of keys in one request. If the request is too large,
+    # bisect keys and fetch each half.
+    start = time.monotonic()
+    try:
+        rows = list(stage.fetch(keys))
+    except Exception as e:
+        if not is_size_error(e) or len(keys) == 1:
+            raise
+        batcher.record_failure(len(keys))
+        instrument.count("batch.bisections", stage.name)
+        logger.warning(
+                "%s: %s, splitting %d keys" % (stage.name, e, len(keys)))
+        half = len(keys) // 2
+        return (fetch_bisecting(stage, batcher, keys[:half])
+                + fetch_bisecting(stage, batcher, keys[half:]))
+    seconds = time.monotonic() - start
+    instrument.observe("request.keys", stage.name, len(keys))
+    instrument.observe("request.seconds", stage.name, seconds)
+    return rows
+
+def fetch_batch(stage, batcher, batch):
+    # Fetch the rows of a batch recorded in the journal, in requests sized
+    # by batcher. (Stages without input keys are fetched by
+    # StageRun.store_stream.)
+    rows = []
+    for keys in batcher.split(stage.fetch_keys(batch)):
+        rows.extend(fetch_bisecting(stage, batcher, keys))
+    return rows
+
+def fetch_with_retry(stage, batcher, batch):
+    # Fetch the rows of batch, retrying with exponential backoff on errors.
+    retries = constants.batch_retries
+    for attempt in range(retries + 1):
+        try:
+            with instrument.timer("batch.fetch_seconds", stage.name):
+                rows = fetch_batch(stage, batcher, batch)
+            instrument.observe("batch.keys", stage.name, len(batch))
+            instrument.observe("batch.rows", stage.name, len(rows))
+            return rows
+        except UpdateError:
+            raise
+        except Exception as e:
+            wait_retry(stage, attempt, e)
+
+def wait_retry(stage, attempt, e):
+    # Wait before retrying a fetch of stage which failed with e, or raise
+    # FetchError if it was the last attempt.
+    retries = constants.batch_retries
+    if attempt == retries:
+        raise FetchError("%s (%d attempts)" % (e, retries + 1))
+    wait = constants.batch_retry_backoff * 2 ** attempt
+    instrument.count("batch.retries", stage.name)
+    instrument.observe("sleep.retry", stage.name, wait)
+    logger.warning(
+            "%s: %s, retrying in %.0f seconds" % (stage.name, e, wait))
+    time.sleep(wait)
+
+def prepare_stage(cursor, stage, incremental, version):
+    # Create the staging table of stage before its batches are stored.
+    #
+    # If incremental is True and the table already exists, its rows are
+    # copied so that only the keys which are new or stale need to be fetched.
+    # (Rows of stale keys are replaced, so their key is indexed beforehand.)
+    # The rows are not copied if the table was created with another schema
+    # (by an older version of MP-manager).
+    staging = bulk_load.staging_name(stage.name)
+    replace_table(cursor, staging, stage.schema_params, [],
+                  stage.primary_key, stage.without_rowid)
+    for intern_table in stage.interned.values():
+        create_intern_table(cursor, intern_table)
+    if stage.input_query is None:
+        return
+    if (incremental and table_exists(cursor, stage.name) and
+            table_schema(cursor, stage.name) == table_schema(cursor, staging)):
+        cursor.execute("INSERT INTO %s SELECT * FROM %s" % (
+            staging, stage.name))
+        if not stage.key_indexed():
+            bulk_load.create_index(
+                    cursor, stage.name, stage.key_columns(), version)
+    else:
+        cursor.execute(
+                "DELETE FROM %s WHERE stage = ?" % loading_names()["fetch_state"],
+                (stage.name,))
+
+def table_schema(cursor, table_name):
+    # [(column name, type, position in the primary key)] of table_name
+    return [(row[1], row[2], row[5]) for row in
+            cursor.execute("PRAGMA table_info(%s)" % table_name).fetchall()]
+
+def finish_stage(cursor, stage, version):
+    # Index the staging table of stage after it is loaded
+    indexes = list(stage.indexes)
+    if not stage.key_indexed():
+        indexes.insert(0, stage.key_columns())
+    for columns in indexes:
+        bulk_load.create_index(cursor, stage.name, columns, version)
+
+def input_keys(cursor, stage):
+    # Input keys of stage in the tables of its input stages
+    query = stage.input_query.format(**loading_names())
+    return [tuple(map(str, row)) for row in cursor.execute(query).fetchall()]
+
+def delete_keys_query(stage):
+    return "DELETE FROM %s WHERE %s" % (
+            bulk_load.staging_name(stage.name),
+            " AND ".join("%s = ?" % c for c in stage.key_columns())
             )
 
+def insert_query(stage):
+    # Query which inserts a fetched row into the staging table of stage.
+    # Interned strings are replaced with their IDs (see intern_strings).
+    values = []
+    for column, _ in stage.schema_params:
+        if column in stage.interned:
+            values.append("(SELECT id FROM %s WHERE name = ?)"
+                    % stage.interned[column])
+        else:
+            values.append("?")
+    return "INSERT %sINTO %s VALUES (%s)" % (
+            "OR IGNORE " if stage.primary_key is not None else "",
+            bulk_load.staging_name(stage.name),
+            ", ".join(values)
+            )
 
-def update_sqlite3db():
-    global stream_logger
-    global file_logger
-    stream_logger = getLogger("stream")
-    file_logger = getLogger("file")
-    stream_handler = StreamHandler(stream=sys.stdout)
-    file_handler = FileHandler(constants.logfile)
-    logformat = Formatter(
-            "[%(asctime)s] %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S"
+def intern_strings(cursor, stage, rows):
+    # Give IDs to the strings of the interned columns in rows
+    for i, (column, _) in enumerate(stage.schema_params):
+        if column in stage.interned:
+            names = set(row[i] for row in rows if row[i] is not None)
+            cursor.executemany(
+                    "INSERT OR IGNORE INTO %s (name) VALUES (?)"
+                    % stage.interned[column],
+                    ((name,) for name in names)
+                    )
+
+def store_batch(cursor, stage, batch, rows, incremental):
+    # Store rows fetched for batch and record when the keys were fetched.
+    # In incremental mode, the old rows of the keys are replaced.
+    if batch is not None and incremental:
+        cursor.executemany(delete_keys_query(stage), batch)
+    intern_strings(cursor, stage, rows)
+    cursor.executemany(insert_query(stage), rows)
+    if cursor.rowcount > 0:
+        instrument.count("sqlite.rows_written", stage.name, cursor.rowcount)
+    if batch is not None:
+        now = time.time()
+        cursor.executemany(
+                "INSERT OR REPLACE INTO %s VALUES (?, ?, ?)"
+                % loading_names()["fetch_state"],
+                ((stage.name, "\t".join(k), now) for k in batch)
+                )
+
+def delete_removed_keys(cursor, stage):
+    # Delete rows (and fetch_state) of keys which are no longer in the input
+    fetch_state = loading_names()["fetch_state"]
+    key_set = set("\t".join(k) for k in input_keys(cursor, stage))
+    fetched_keys = [k for (k,) in cursor.execute(
+        "SELECT key FROM %s WHERE stage = ?" % fetch_state, (stage.name,)
+        ).fetchall()]
+    removed_keys = [tuple(k.split("\t"))
+            for k in fetched_keys if k not in key_set]
+    cursor.executemany(delete_keys_query(stage), removed_keys)
+    cursor.executemany(
+            "DELETE FROM %s WHERE stage = ? AND key = ?" % fetch_state,
+            ((stage.name, "\t".join(k)) for k in removed_keys)
             )
-    stream_handler.setFormatter(logformat)
-    file_handler.setFormatter(logformat)
-    stream_logger.addHandler(stream_handler)
-    file_logger.addHandler(file_handler)
-    stream_logger.setLevel(INFO)
-    file_logger.setLevel(INFO)
+    return len(removed_keys)
 
-    mitoproteome_tuples = get_mito_id_gene_id_pairs()
+protein_csv_query = (
+        "SELECT pdb_info.pdb_id, "
+        "chain_info.chain_id, uniprot_info.uniprot_ac, "
+        "uniprot_info.protein_names, uniprot_info.gene_names, "
+        "organisms.name AS organism, uniprot_kegg.kegg_id, "
+        "mitoproteome.mito_id, gene_uniprot.gene_id, "
+        "pdb_info.resolution, chain_info.length\n"
+        "FROM {pdb_info} AS pdb_info, {chain_info} AS chain_info, "
+        "{uniprot_info} AS uniprot_info, {uniprot_pdb} AS uniprot_pdb, "
+        "{uniprot_kegg} AS uniprot_kegg, {mitoproteome} AS mitoproteome, "
+        "{gene_uniprot} AS gene_uniprot\n"
+        "LEFT JOIN organisms ON organisms.id = uniprot_info.organism_id\n"
+        "WHERE mitoproteome.gene_id = gene_uniprot.gene_id\n"
+        "AND gene_uniprot.uniprot_ac = uniprot_info.uniprot_ac\n"
+        "AND gene_uniprot.uniprot_ac = uniprot_pdb.uniprot_ac\n"
+        "AND gene_uniprot.uniprot_ac = uniprot_kegg.uniprot_ac\n"
+        "AND uniprot_kegg.kegg_gene_id = gene_uniprot.gene_id\n"
+        "AND uniprot_pdb.pdb_id = pdb_info.pdb_id\n"
+        "AND pdb_info.pdb_id = chain_info.pdb_id\n"
+        "AND pdb_info.chain_id = chain_info.chain_id\n"
+        "AND chain_info.uniprot_ac = uniprot_info.uniprot_ac"
+        )
+# table name: protein_csv
+#
+# columns:
+#
+# pdb_id | chain_id | uniprot_ac | protein_names | gene_names | organism | kegg_id | mito_id | gene_id | resolution | length
+# -------+----------+------------+---------------+------------+----------+---------+---------+---------+------------+-------
 
-    try:
-        with sqlite3.connect(constants.sqlite3_dbpath) as conn:
-            cursor = conn.cursor()
-            table_name = "mitoproteome"
-            schema_params = [
-                    ("mito_id", "TEXT"),
-                    ("gene_id", "INTEGER"),
-                    ]
-            tuples = mitoproteome_tuples
-            replace_table(cursor, table_name, schema_params, tuples)
-
-            select_query = \
-                    "SELECT DISTINCT gene_id \
-                    FROM mitoproteome"
-            results = cursor.execute(select_query)
+protein_csv_indexes = [
+        ["pdb_id", "chain_id"],
+        ["uniprot_ac"],
+        ["gene_id"],
+        ["mito_id"],
+        ["kegg_id"],
+        ["organism"],
+        ["resolution"],
+        ["length"],
+        ]
+
+def build_protein_csv(cursor, version):
+    # Materialize the join of all staging tables into the indexed staging
+    # table of protein_csv, so that pickout only needs index lookups.
+    cursor.execute("ANALYZE")
+    staging = bulk_load.staging_name("protein_csv")
+    cursor.execute("DROP TABLE IF EXISTS %s" % staging)
+    cursor.execute("CREATE TABLE %s AS %s" % (
+        staging, protein_csv_query.format(**loading_names())))
+    for columns in protein_csv_indexes:
+        bulk_load.create_index(cursor, "protein_csv", columns, version)
+    cursor.execute("ANALYZE %s" % staging)
+
+# table name: protein_csv_history
+#
+# Every row which protein_csv has had since the table was created, with
+#   row_hash : hash of all columns
+#   added : version of the data in which the row appeared
+#   removed : version in which the row disappeared (NULL if it is in
+#             protein_csv)
+# so that the changes after any version can be selected (see
+# pickout.pickout_since). Only added and removed rows are written by an
+# update, and rows are never deleted.
+# A changed row has the same PDB ID, chain ID, UniProt AC, KEGG ID, Mito ID
+# and Gene ID as the row it replaces.
+history_columns = [
+        ("row_hash", "INTEGER"),
+        ("added", "INTEGER"),
+        ("removed", "INTEGER"),
+        ]
+
+history_indexes = [
+        ["pdb_id", "chain_id"],
+        ["removed", "added"],
+        ]
+
+def row_hash(*values):
+    # 64-bit hash of values (as a signed integer, which sqlite can store)
+    data = repr(values).encode("utf-8")
+    return int.from_bytes(
+            hashlib.blake2b(data, digest_size=8).digest(), "big", signed=True)
 
+def hash_protein_csv(cursor):
+    # Hash the rows of the staging table of protein_csv into the staging
+    # table of protein_csv_hashes (row_id: rowid in protein_csv), before the
+    # tables are swapped.
+    cursor.connection.create_function(
+            "row_hash", -1, row_hash, deterministic=True)
+    staging = bulk_load.staging_name("protein_csv_hashes")
+    cursor.execute("DROP TABLE IF EXISTS %s" % staging)
+    cursor.execute(
+            "CREATE TABLE %s (row_id INTEGER PRIMARY KEY, row_hash INTEGER)"
+            % staging)
+    columns = [column for column, _, _ in table_schema(
+        cursor, bulk_load.staging_name("protein_csv"))]
+    cursor.execute(
+            "INSERT INTO %s SELECT rowid, row_hash(%s) FROM %s" % (
+                staging, ", ".join(columns),
+                bulk_load.staging_name("protein_csv")))
+    cursor.execute("CREATE INDEX %s_row_hash ON %s (row_hash)" % (
+        staging, staging))
+
+def create_history_table(cursor):
+    # Create protein_csv_history with the columns of protein_csv. A history
+    # of other columns (written by an older version of MP-manager) is
+    # started again.
+    schema = [(column, column_type) for column, column_type, _ in
+              table_schema(cursor, "protein_csv")] + history_columns
+    if table_exists(cursor, "protein_csv_history"):
+        if [(column, column_type) for column, column_type, _ in
+                table_schema(cursor, "protein_csv_history")] == schema:
+            return
+        cursor.execute("DROP TABLE protein_csv_history")
+    cursor.execute("CREATE TABLE protein_csv_history (%s)" % ", ".join(
+        "%s %s" % t for t in schema))
+    for columns in history_indexes:
+        cursor.execute("CREATE INDEX protein_csv_history_%s "
+                "ON protein_csv_history (%s)" % (
+                    "_".join(columns), ", ".join(columns)))
+    cursor.execute("CREATE INDEX protein_csv_history_current "
+            "ON protein_csv_history (row_hash) WHERE removed IS NULL")
+
+def record_history(cursor, version):
+    # Record the rows removed from and added to protein_csv in version.
+    # This runs in the transaction of the swap, after protein_csv has been
+    # replaced.
+    create_history_table(cursor)
+    hashes = bulk_load.staging_name("protein_csv_hashes")
+    cursor.execute(
+            "UPDATE protein_csv_history SET removed = ? "
+            "WHERE removed IS NULL "
+            "AND row_hash NOT IN (SELECT row_hash FROM %s)" % hashes,
+            (version,))
+    removed = cursor.rowcount
+    cursor.execute(
+            "INSERT INTO protein_csv_history "
+            "SELECT protein_csv.*, hashes.row_hash, ?, NULL "
+            "FROM %s AS hashes, protein_csv "
+            "WHERE protein_csv.rowid = hashes.row_id "
+            "AND hashes.row_hash NOT IN (SELECT row_hash "
+            "FROM protein_csv_history WHERE removed IS NULL)" % hashes,
+            (version,))
+    added = cursor.rowcount
+    cursor.execute("DROP TABLE %s" % hashes)
+    return added, removed
+
+class StageRun:
+    # State of a stage during an update
+    #
+    # queue : rows fetched by the input stages (None when an input stage
+    #         finishes)
+    # subscribers : queues of the stages which take this stage as input
+    # cprofile_path : file to which cProfile statistics of the stage (its
+    #                 own thread and its fetches) are written, or None
+    # progress : function called as progress(stage name, rows stored, done)
+    #            after every stored batch and when the stage finishes, or
+    #            None (see update_sqlite3db)
+    # db_path : database (constants.sqlite3_dbpath if None)
+    def __init__(self, stage, incremental, max_age, resume, version,
+                 cprofile_path=None, progress=None, db_path=None):
+        self.stage = stage
+        self.name = stage.name
+        self.inputs = stage.inputs
+        self.incremental = incremental
+        self.max_age = max_age
+        self.resume = resume
+        self.version = version
+        self.queue = queue.Queue()
+        self.subscribers = []
+        self.cprofile_path = cprofile_path
+        self.progress = progress
+        self.db_path = db_path
+        self.profiles = []
+        self.profiles_lock = threading.Lock()
+
+    def profiled(self, f, *args):
+        # f(*args), profiled if cprofile_path is given.
+        # cProfile profiles one thread, so each call has its own profile,
+        # and profiles are merged when the stage finishes.
+        if self.cprofile_path is None:
+            return f(*args)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return f(*args)
+        finally:
+            profile.disable()
+            with self.profiles_lock:
+                self.profiles.append(profile)
+
+    def fetch(self, batcher, batch):
+        return self.profiled(fetch_with_retry, self.stage, batcher, batch)
+
+    def store_stream(self, conn, cursor, i):
+        # Store the rows of a stage without input keys (batch i of the
+        # journal) in chunks of journal_batch_size rows as soon as they are
+        # parsed, and stream them to the subscribers.
+        # The whole table is fetched again if the fetch fails; the rows
+        # stored so far are deleted, and the subscribers skip the keys they
+        # have already received.
+        stage = self.stage
+        staging = bulk_load.staging_name(stage.name)
+        for attempt in range(constants.batch_retries + 1):
+            cursor.execute("DELETE FROM %s" % staging)
             conn.commit()
-    except sqlite3.Error as e:
-        # print("ERROR at mitoproteome")
-        sys.stderr.write("%s\n" % e)
-        quit(1)
+            n_rows = 0
+            try:
+                with instrument.timer("batch.fetch_seconds", stage.name):
+                    for chunk in iterator_tools.split_iterator(
+                            stage.fetch(), constants.journal_batch_size):
+                        rows = list(chunk)
+                        with instrument.timer(
+                                "sqlite.store_seconds", stage.name):
+                            store_batch(cursor, stage, None, rows, False)
+                            conn.commit()
+                        self.emit(rows)
+                        n_rows += len(rows)
+                        self.report(stage.name, n_rows)
+            except (sqlite3.Error, UpdateError):
+                raise
+            except Exception as e:
+                wait_retry(stage, attempt, e)
+                continue
+            journal.mark_done(cursor, stage.name, i)
+            conn.commit()
+            instrument.observe("batch.rows", stage.name, n_rows)
+            return n_rows
 
-    gene_ids = map(lambda p: str(p[0]), results)
-    gene_id_uniprot_ac_pairs = get_with_sleep(get_uniprot_acs, gene_ids)
+    def dump_profiles(self):
+        if not self.profiles:
+            return
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.cprofile_path)
 
-    try:
-        with sqlite3.connect(constants.sqlite3_dbpath) as conn:
-            cursor = conn.cursor()
-            table_name = "gene_uniprot"
-            schema_params = [
-                    ("gene_id", "INTEGER"),
-                    ("uniprot_ac", "TEXT"),
-                    ]
-            tuples = gene_id_uniprot_ac_pairs
-            replace_table(cursor, table_name, schema_params, tuples)
-
-            select_query = \
-                    "SELECT DISTINCT uniprot_ac \
-                    FROM gene_uniprot"
-            results = cursor.execute(select_query)
+    def input_messages(self, cursor, aborted):
+        # Yield lists of input keys: first the keys already stored in the
+        # input tables, then the keys in the rows streamed by the input
+        # stages until all of them finish. An empty list is yielded when no
+        # rows arrive for a while.
+        yield input_keys(cursor, self.stage)
+        remaining = len(self.stage.inputs)
+        while remaining > 0:
+            try:
+                rows = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if aborted.is_set():
+                    raise scheduler.Aborted()
+                yield []
+                continue
+            if rows is None:
+                remaining -= 1
+            else:
+                yield [tuple(map(str, self.stage.stream_key(row)))
+                        for row in rows]
+        if aborted.is_set():
+            raise scheduler.Aborted()
 
+    def new_batches(self, conn, seen, aborted):
+        # Yield (index, batch) of the input keys which are not in seen (and
+        # are new or stale in incremental mode), recording batches in the
+        # journal. Keys are grouped into batches of journal_batch_size keys;
+        # only the last batch, when all input stages finish, is smaller, so
+        # that the batches (and the requests, see http_cache.py) depend on
+        # the keys only and not on the timing of the input stages.
+        # None is yielded while waiting for input keys.
+        cursor = conn.cursor()
+        if self.incremental:
+            fetched_at = dict(cursor.execute(
+                "SELECT key, fetched_at FROM %s WHERE stage = ?"
+                % loading_names()["fetch_state"],
+                (self.stage.name,)
+                ).fetchall())
+        else:
+            fetched_at = {}
+        now = time.time()
+        index = journal.batch_count(cursor, self.stage.name)
+        size = constants.journal_batch_size
+        pending = []
+        for keys in self.input_messages(cursor, aborted):
+            for key in keys:
+                if key in seen:
+                    continue
+                seen.add(key)
+                age = now - fetched_at.get("\t".join(key), now - self.max_age)
+                if age < self.max_age:
+                    continue
+                pending.append(key)
+            if len(pending) < size:
+                yield None
+            while len(pending) >= size:
+                journal.add_batch(cursor, self.stage.name, index, pending[:size])
+                conn.commit()
+                yield index, pending[:size]
+                pending = pending[size:]
+                index += 1
+        while pending:
+            journal.add_batch(cursor, self.stage.name, index, pending[:size])
             conn.commit()
-    except sqlite3.Error as e:
-        # print("ERROR at entrez_gene")
-        sys.stderr.write("%s\n" % e)
-        quit(1)
+            yield index, pending[:size]
+            pending = pending[size:]
+            index += 1
 
-    uniprot_ac_list = [p[0] for p in results]
+    def emit(self, rows):
+        for subscriber in self.subscribers:
+            subscriber.put(rows)
 
-    uniprot_infos = get_with_sleep(get_uniprot_info, uniprot_ac_list)
-    uniprot_ac_pdb_id_pairs = get_with_sleep(get_pdb_ids, uniprot_ac_list)
-    uniprot_ac_kegg_id_pairs = get_with_sleep(get_kegg_id, uniprot_ac_list)
+    def report(self, name, n_rows, done=False):
+        if self.progress is not None:
+            self.progress(name, n_rows, done)
 
-    del uniprot_ac_list
+    def run(self, ready, aborted):
+        # Fill the staging table of the stage batch by batch.
+        # Every batch is committed together with its journal entry, so that
+        # the stage can be resumed from the first batch which is not done.
+        try:
+            with bulk_load.connect(self.db_path) as conn:
+                self.profiled(self.update, conn, ready, aborted)
+        except sqlite3.Error as e:
+            raise UpdateError("ERROR at %s: %s" % (self.stage.name, e))
+        except FetchError as e:
+            raise UpdateError(
+                    "ERROR at %s: %s\n"
+                    "Execute `./main.py update --resume` to continue."
+                    % (self.stage.name, e))
+        finally:
+            for subscriber in self.subscribers:
+                subscriber.put(None)
+            self.dump_profiles()
 
-    try:
-        with sqlite3.connect(constants.sqlite3_dbpath) as conn:
-            cursor = conn.cursor()
-            table_name = "uniprot_info"
-            schema_params = [
-                    ("uniprot_ac", "TEXT"),
-                    ("protein_names", "TEXT"),
-                    ("gene_names", "TEXT"),
-                    ("organism", "TEXT"),
-                    ]
-            tuples = uniprot_infos
-            replace_table(cursor, table_name, schema_params, tuples)
-
-            table_name = "uniprot_pdb"
-            schema_params = [
-                    ("uniprot_ac", "TEXT"),
-                    ("pdb_id", "TEXT"),
-                    ]
-            tuples = uniprot_ac_pdb_id_pairs
-            replace_table(cursor, table_name, schema_params, tuples)
-
-            table_name = "uniprot_kegg"
-            schema_params = [
-                    ("uniprot_ac", "TEXT"),
-                    ("kegg_id", "TEXT"),
-                    ]
-            tuples = uniprot_ac_kegg_id_pairs
-            replace_table(cursor, table_name, schema_params, tuples)
-
-            select_query = \
-                    "SELECT DISTINCT pdb_id \
-                    FROM uniprot_pdb"
-            results = cursor.execute(select_query)
+    def update(self, conn, ready, aborted):
+        stage = self.stage
+        cursor = conn.cursor()
+        status = journal.stage_status(cursor, stage.name)
+        if self.resume and status == "done":
+            logger.info("%s: already done" % stage.name)
+            return
+        if self.resume and status == "partial":
+            self.incremental = journal.is_incremental(cursor, stage.name)
+            pending = journal.pending_batches(cursor, stage.name)
+            seen = set(tuple(k) for k in
+                    journal.journaled_keys(cursor, stage.name))
+            logger.info(
+                    "%s: resuming (%d batches left)" % (stage.name, len(pending)))
+        else:
+            journal.clear(cursor, stage.name)
+            prepare_stage(cursor, stage, self.incremental, self.version)
+            journal.start_stage(cursor, stage.name, self.incremental)
+            pending = []
+            seen = set()
+            if stage.input_query is None:
+                # no input keys: the whole table is fetched every time
+                # (see store_stream)
+                journal.add_batch(cursor, stage.name, 0, None)
+                pending = [(0, None)]
+        conn.commit()
+        # The table exists now, and its rows will be streamed.
+        ready()
 
-            conn.commit()
-    except sqlite3.Error as e:
-        # print("ERROR at uniprot")
-        sys.stderr.write("%s\n" % e)
-        quit(1)
-
-    pdb_ids = map(lambda p: p[0], results)
-    pdb_infos = get_with_sleep(get_pdb_info, pdb_ids)
-
-    pdb_info_tuples = iterator_tools.concat_iterator(
-            *iterator_tools.concat_iterator(
-                *map(lambda t:
-                    # t = (PDB ID,
-                    #      resolution,
-                    #      [(entity ID, [chain ID ...]) ...])
-                    map(lambda lt:    # l = (entity ID, [chain ID ...])
-                        map(lambda c: # c is chain ID
-                            (t[0], t[1], lt[0], c),
-                            # (PDB ID, resolution, entity ID, chain ID)
-                            lt[1] # [chain ID ...]
-                            ),
-                        # [(PDB ID, resolution, entity ID, chain ID) ...]
-                        t[2] # [(entity ID, [chain ID ...]) ...]
-                        ),
-                    # [[(PDB ID, resolution, entity ID, chain ID) ...] ...]
-                    pdb_infos
-                    # [(PDB ID,
-                    #   resolution,
-                    #   [(entity ID, [chain ID ...]) ...]) ...]
-                    )
-                # [[[(PDB ID, resolution, entity ID, chain ID) ...] ...] ...]
-                ) # [[(PDB ID, resolution, entity ID, chain ID) ...] ...]
-            )     # [(PDB ID, resolution, entity ID, chain ID) ...]
-    # pdb_info_tuples = [(PDB ID, resolution, entity ID, chain ID) ...]
+        n_rows = 0
+        batches = []
+        if stage.input_query is None:
+            for i, _ in pending:
+                n_rows += self.store_stream(conn, cursor, i)
+        else:
+            batches = chain(pending, self.new_batches(conn, seen, aborted))
+        batcher = stage.make_batcher() if stage.input_query is not None else None
+
+        # Batches are fetched by constants.fetch_workers threads, and stored
+        # (by this thread) in order as soon as they are fetched.
+        in_flight = deque()
+        def store_first():
+            nonlocal n_rows
+            i, batch, future = in_flight.popleft()
+            rows = future.result()
+            with instrument.timer("sqlite.store_seconds", stage.name):
+                store_batch(cursor, stage, batch, rows, self.incremental)
+                journal.mark_done(cursor, stage.name, i)
+                conn.commit()
+            self.emit(rows)
+            n_rows += len(rows)
+            self.report(stage.name, n_rows)
+
+        with ThreadPoolExecutor(constants.fetch_workers) as executor:
+            for item in batches:
+                if aborted.is_set():
+                    raise scheduler.Aborted()
+                if item is not None:
+                    i, batch = item
+                    in_flight.append((i, batch, executor.submit(
+                        self.fetch, batcher, batch)))
+                while in_flight and (in_flight[0][2].done() or
+                        len(in_flight) >= 2 * constants.fetch_workers):
+                    store_first()
+            while in_flight:
+                if aborted.is_set():
+                    raise scheduler.Aborted()
+                store_first()
+
+        with instrument.timer("sqlite.index_seconds", stage.name):
+            finish_stage(cursor, stage, self.version)
+        removed = 0
+        if stage.input_query is not None:
+            removed = delete_removed_keys(cursor, stage)
+        journal.finish_stage(cursor, stage.name)
+        conn.commit()
+        logger.info("%s: %d rows stored, %d keys removed" % (
+            stage.name, n_rows, removed))
+        self.report(stage.name, n_rows, True)
+
+class LocalRun:
+    # Task which loads the tables of stages from local dumps instead of
+    # fetching them (see local_source.py)
+    #
+    # name : name of the task
+    # stages : stages whose tables are loaded
+    # input_query : query that selects the input keys (as in Stage)
+    # inputs : names of the tables input_query reads; they are read after
+    #          the tasks filling them finish
+    # load : function that takes the set of input keys (str) and returns an
+    #        iterator of (stage name, row)
+    # queue, subscribers : as in StageRun (no rows are streamed; dependent
+    #                      stages read the tables when this task finishes)
+    # progress : as in StageRun (called with the names of stages)
+    # db_path : as in StageRun
+    def __init__(self, name, stages, input_query, inputs, load, resume,
+                 version, progress=None, db_path=None):
+        self.name = name
+        self.stages = stages
+        self.input_query = input_query
+        self.inputs = list(inputs)
+        self.load = load
+        self.resume = resume
+        self.version = version
+        self.progress = progress
+        self.db_path = db_path
+        self.queue = queue.Queue()
+        self.subscribers = []
+
+    def report(self, name, n_rows, done=False):
+        if self.progress is not None:
+            self.progress(name, n_rows, done)
+
+    def run(self, ready, aborted):
+        try:
+            with bulk_load.connect(self.db_path) as conn:
+                self.update(conn, aborted)
+        except sqlite3.Error as e:
+            raise UpdateError("ERROR at %s: %s" % (self.name, e))
+        except (OSError, EOFError) as e:
+            # unreadable or truncated dump
+            raise UpdateError("ERROR at %s: %s" % (self.name, e))
+        finally:
+            for subscriber in self.subscribers:
+                subscriber.put(None)
+
+    def wait_inputs(self, aborted):
+        # Wait until the tasks filling the input tables finish
+        remaining = len(self.inputs)
+        while remaining > 0:
+            try:
+                rows = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if aborted.is_set():
+                    raise scheduler.Aborted()
+                continue
+            if rows is None:
+                remaining -= 1
+
+    def update(self, conn, aborted):
+        cursor = conn.cursor()
+        if self.resume and all(
+                journal.stage_status(cursor, stage.name) == "done"
+                for stage in self.stages):
+            logger.info("%s: already done" % self.name)
+            return
+        self.wait_inputs(aborted)
+        keys = set(row[0] for row in cursor.execute(
+            self.input_query.format(**loading_names())).fetchall())
+        keys = set(map(str, keys))
+        for stage in self.stages:
+            journal.clear(cursor, stage.name)
+            prepare_stage(cursor, stage, False, self.version)
+            journal.start_stage(cursor, stage.name, False)
+        conn.commit()
+
+        # Rows are stored in chunks of journal_batch_size rows per table
+        by_name = {stage.name: stage for stage in self.stages}
+        chunks = {name: [] for name in by_name}
+        n_rows = dict.fromkeys(by_name, 0)
+        def store(name):
+            with instrument.timer("sqlite.store_seconds", name):
+                store_batch(cursor, by_name[name], None, chunks[name], False)
+            n_rows[name] += len(chunks[name])
+            chunks[name] = []
+            self.report(name, n_rows[name])
+        with instrument.timer("local.load_seconds", self.name):
+            for name, row in self.load(keys):
+                chunks[name].append(row)
+                if len(chunks[name]) >= constants.journal_batch_size:
+                    store(name)
+                    if aborted.is_set():
+                        raise scheduler.Aborted()
+            for name in by_name:
+                store(name)
+        instrument.count("parse.rows", self.name, sum(n_rows.values()))
+
+        # The keys are not recorded in fetch_state (prepare_stage has
+        # cleared those of the stages), so that an online incremental update
+        # fetches all of them instead of keeping the data of the dumps.
+        for stage in self.stages:
+            with instrument.timer("sqlite.index_seconds", stage.name):
+                finish_stage(cursor, stage, self.version)
+            journal.finish_stage(cursor, stage.name)
+            logger.info("%s: %d rows loaded from local dumps" % (
+                stage.name, n_rows[stage.name]))
+            self.report(stage.name, n_rows[stage.name], True)
+        conn.commit()
+
+def local_idmapping_rows(path, gene_ids):
+    for name, row in local_source.iter_idmapping(path, gene_ids):
+        if name == "uniprot_kegg":
+            row = row + split_kegg_id(row[1])
+        yield name, row
+
+def local_runs(directory, resume, version, progress=None, db_path=None):
+    # Tasks which load the mapping tables from the dumps in directory:
+    # idmapping loads gene_uniprot, uniprot_pdb and uniprot_kegg of the Gene
+    # IDs in mitoproteome, and sifts loads chain_info of the PDB IDs in
+    # uniprot_pdb.
+    idmapping_path, sifts_path = local_source.dump_paths(directory)
+    by_name = {stage.name: stage for stage in stages}
+    return [
+            LocalRun(
+                "idmapping",
+                [by_name["gene_uniprot"], by_name["uniprot_pdb"],
+                    by_name["uniprot_kegg"]],
+                by_name["gene_uniprot"].input_query,
+                ["mitoproteome"],
+                lambda gene_ids: local_idmapping_rows(idmapping_path, gene_ids),
+                resume, version, progress, db_path
+                ),
+            LocalRun(
+                "sifts",
+                [by_name["chain_info"]],
+                by_name["pdb_info"].input_query,
+                ["uniprot_pdb"],
+                lambda pdb_ids: (("chain_info", row) for row in
+                    local_source.iter_sifts_chains(sifts_path, pdb_ids)),
+                resume, version, progress, db_path
+                ),
+            ]
 
+# stages whose tables local_runs loads from the dumps
+local_stage_names = ["gene_uniprot", "uniprot_pdb", "uniprot_kegg", "chain_info"]
+
+def report_timings(tasks, timings):
+    # Log when each stage ran, marking the stages on the critical path
+    path = scheduler.critical_path(tasks, timings)
+    for task in tasks:
+        if task.name not in timings:
+            continue
+        start, end = timings[task.name]
+        logger.info("%s%-14s %8.1f s - %8.1f s (%8.1f s)" % (
+            "*" if task.name in path else " ",
+            task.name, start, end, end - start))
+    logger.info("critical path: %s" % " -> ".join(path))
+
+def cprofile_path(profile_path, stage_name):
+    # "out.json" -> "out.<stage_name>.prof"
+    return "%s.%s.prof" % (os.path.splitext(profile_path)[0], stage_name)
+
+def write_profile(path, tasks, timings, seconds, cprofile_paths):
+    # Write the instrumentation report of the update to path in JSON
+    profile = {
+            "seconds" : seconds,
+            "stages" : {name: {"start" : start, "end" : end}
+                for name, (start, end) in timings.items()},
+            "critical_path" : scheduler.critical_path(tasks, timings),
+            "cprofile" : cprofile_paths,
+            }
+    profile.update(instrument.report())
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+
+def update_sqlite3db(use_cache=True, offline=False,
+                     incremental=False, max_age=None, resume=False,
+                     snapshot_path=None, profile_path=None,
+                     cprofile_stages=(), source="online", progress=None,
+                     db_path=None):
+    # use_cache : reuse HTTP responses cached by earlier runs (http_cache.py)
+    # offline : use cached responses only (no network access)
+    # incremental : fetch only new keys and keys older than max_age
+    # max_age : seconds (constants.incremental_max_age if None)
+    # resume : continue an interrupted update from the batches which are
+    #          not done (see journal.py)
+    # snapshot_path : also write protein_csv to this snapshot file
+    #                 (see snapshot.py) if not None
+    # profile_path : write the instrumentation report (see instrument.py) to
+    #                this JSON file if not None
+    # cprofile_stages : names of stages profiled by cProfile (statistics are
+    #                   written beside profile_path, see cprofile_path)
+    # source : "online", or "local:DIR" to load the mapping tables from the
+    #          dumps in DIR (see local_source.py)
+    # progress : function called as progress(table name, rows stored, done)
+    #            while the tables are loaded, and as progress("protein_csv",
+    #            rows, True) when they are published, or None. It is called
+    #            from the threads of the stages.
+    # db_path : database to update (constants.sqlite3_dbpath if None)
+    #
+    # Progress is logged to the "update" logger, which has no handlers
+    # unless setup_logging is called (as main.py does).
+    # Return {stage name: (start, end)} (seconds, see scheduler.run_tasks).
+    # Raise UpdateError if the update fails.
+    instrument.reset()
+    start = time.perf_counter()
+
+    http_cache.configure(use_cache, offline)
+    if max_age is None:
+        max_age = constants.incremental_max_age
     try:
-        with sqlite3.connect(constants.sqlite3_dbpath) as conn:
-            cursor = conn.cursor()
-            table_name = "pdb_info"
-            schema_params = [
-                    ("pdb_id", "TEXT"),
-                    ("resolution", "REAL"),
-                    ("entity_id", "INTEGER"),
-                    ("chain_id", "TEXT"),
-                    ]
-            tuples = pdb_info_tuples
-            replace_table(cursor, table_name, schema_params, tuples)
-
-            select_query = \
-                    "SELECT DISTINCT pdb_id, chain_id \
-                    FROM pdb_info"
-            results = cursor.execute(select_query)
+        local_dir = local_source.source_directory(source)
+    except ValueError as e:
+        raise UpdateError(str(e))
+    if local_dir is not None:
+        missing = local_source.missing_dumps(local_dir)
+        if missing:
+            raise UpdateError("not found: %s" % ", ".join(missing))
+        # LocalRun tasks are not profiled by cProfile
+        local = [name for name in cprofile_stages if name in local_stage_names]
+        if local:
+            raise UpdateError("cannot profile %s: loaded from the dumps"
+                              % ", ".join(local))
 
+    # All stages load staging tables, which replace the live tables at the
+    # end of the update (see bulk_load.py).
+    table_names = [stage.name for stage in stages] + ["fetch_state"]
+    try:
+        with bulk_load.connect(db_path) as conn:
+            cursor = conn.cursor()
+            create_fetch_state_table(cursor)
+            journal.create_table(cursor)
+            version = bulk_load.get_version(cursor) + 1
+            if not resume or journal.is_empty(cursor):
+                journal.clear(cursor)
+                bulk_load.drop_staging_tables(
+                        cursor,
+                        table_names + ["protein_csv", "protein_csv_hashes"])
+                staging_fetch_state = loading_names()["fetch_state"]
+                create_fetch_state_table(cursor, staging_fetch_state)
+                cursor.execute("INSERT INTO %s SELECT * FROM fetch_state"
+                        % staging_fetch_state)
             conn.commit()
     except sqlite3.Error as e:
-        # print("ERROR at PDB")
-        sys.stderr.write("%s\n" % e)
-        quit(1)
+        raise UpdateError(str(e))
 
-    chain_infos = get_with_sleep(get_chain_info, results)
+    # Stages run concurrently. Each stage starts as soon as the tables of
+    # its input stages are created, and takes their rows as they are stored.
+    # With a local source, the tables of some stages are loaded by
+    # LocalRun tasks instead.
+    loads = []
+    if local_dir is not None:
+        loads = local_runs(local_dir, resume, version, progress, db_path)
+    loaded = set(stage.name for load in loads for stage in load.stages)
+    runs = {stage.name: StageRun(
+                stage, incremental, max_age, resume, version,
+                cprofile_path(profile_path, stage.name)
+                if stage.name in cprofile_stages else None,
+                progress, db_path)
+            for stage in stages if stage.name not in loaded}
+    # task which fills each table
+    providers = dict(runs)
+    for load in loads:
+        for stage in load.stages:
+            providers[stage.name] = load
+    tasks = []
+    for run in list(runs.values()) + loads:
+        deps = []
+        for name in run.inputs:
+            providers[name].subscribers.append(run.queue)
+            if providers[name].name not in deps:
+                deps.append(providers[name].name)
+        tasks.append(scheduler.Task(run.name, run.run, deps))
+    timings = scheduler.run_tasks(tasks)
+    report_timings(tasks, timings)
 
     try:
-        with sqlite3.connect(constants.sqlite3_dbpath) as conn:
-            cursor = conn.cursor()
-            table_name = "chain_info"
-            schema_params = [
-                    ("pdb_id", "TEXT"),
-                    ("chain_id", "TEXT"),
-                    ("length", "INTEGER"),
-                    ("uniprot_ac", "TEXT"),
-                    ]
-            tuples = chain_infos
-            replace_table(cursor, table_name, schema_params, tuples)
-
-            conn.commit()
+        with bulk_load.connect(db_path) as conn:
+            with instrument.timer("sqlite.build_seconds", "protein_csv"):
+                build_protein_csv(conn.cursor(), version)
+            with instrument.timer("sqlite.hash_seconds", "protein_csv"):
+                hash_protein_csv(conn.cursor())
+            # Publish all tables at once, together with the changes of
+            # protein_csv. Readers see either the old or the new tables.
+            with instrument.timer("sqlite.swap_seconds"):
+                cursor = bulk_load.begin_swap(
+                        conn, table_names + ["protein_csv"], version)
+                added, removed = record_history(cursor, version)
+                journal.clear(cursor)
+                conn.commit()
+            logger.info("protein_csv: version %d, %d rows added, %d removed"
+                        % (version, added, removed))
+            if progress is not None:
+                progress("protein_csv", cursor.execute(
+                    "SELECT COUNT(*) FROM protein_csv").fetchone()[0], True)
     except sqlite3.Error as e:
-        # print("ERROR at chain")
-        sys.stderr.write("%s\n" % e)
-        quit(1)
+        raise UpdateError("ERROR at protein_csv: %s" % e)
+
+    if snapshot_path is not None:
+        try:
+            with sqlite3.connect(db_path or constants.sqlite3_dbpath) as conn, \
+                    instrument.timer("sqlite.snapshot_seconds"):
+                n_rows = snapshot.write_snapshot(
+                        conn.cursor(), snapshot_path, version)
+        except (OSError, sqlite3.Error) as e:
+            raise UpdateError("ERROR at snapshot: %s" % e)
+        logger.info("snapshot: %d rows written to %s"
+                    % (n_rows, snapshot_path))
+
+    http_session.close_session()
+    http_cache.close()
+
+    if profile_path is not None:
+        try:
+            write_profile(profile_path, tasks, timings,
+                          time.perf_counter() - start,
+                          [runs[name].cprofile_path
+                              for name in cprofile_stages if name in runs])
+        except OSError as e:
+            raise UpdateError("ERROR at profile: %s" % e)
+        logger.info("profile written to %s" % profile_path)
 
-    print("Update finished.")
-    stream_handler.flush()
-    file_handler.close()
+    for handler in logger.handlers:
+        handler.flush()
+    return timings